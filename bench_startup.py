@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: wall time from starting the interpreter to the first
+parsed PKGBUILD, imports done the way main.py does them. One more run
+with `python -X importtime` shows where the import time goes and whether
+modules only remote checks need were loaded.
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# a local-only run shouldn't import these
+REMOTE_ONLY = ("nvchecker.get_version", "tornado", "pkg_resources",
+               "requests")
+
+CHILD = """
+import sys
+sys.path.insert(0, {here!r})
+import main
+from nvnotifier.repo import PKGBUILDPac
+PKGBUILDPac({path!r}).update_local()
+print("parsed", flush=True)
+"""
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def run_child(path, importtime=False):
+    """(seconds to the first parse, stderr of the child)"""
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", CHILD.format(here=HERE, path=os.path.abspath(path))]
+
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    line = proc.stdout.readline()
+    elapsed = time.perf_counter() - start
+    _, err = proc.communicate()
+    if line.strip() != "parsed":
+        raise RuntimeError("child failed:\n%s" % err)
+    return elapsed, err
+
+
+def parse_importtime(err):
+    """[(cumulative us, self us, depth, module)] from -X importtime"""
+    ret = []
+    for line in err.splitlines():
+        m = _IMPORTTIME.match(line)
+        if m:
+            ret.append((int(m.group(2)), int(m.group(1)),
+                        len(m.group(3)) // 2, m.group(4)))
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("pkgbuild", help="a PKGBUILD to parse")
+    parser.add_argument("-r", "--runs", type=int, default=10,
+                        help="timed runs (default: 10)")
+    parser.add_argument("-t", "--top", type=int, default=15,
+                        help="slowest imports to show (default: 15)")
+    args = parser.parse_args()
+
+    times = [run_child(args.pkgbuild)[0] for _ in range(args.runs)]
+    print("first PKGBUILD parsed in %.1f ms (median of %d, min %.1f ms)" %
+          (statistics.median(times) * 1e3, len(times), min(times) * 1e3))
+
+    imports = parse_importtime(run_child(args.pkgbuild, importtime=True)[1])
+    total = sum(cum for cum, _, depth, _ in imports if depth == 0)
+    print("imports: %.1f ms in %d modules" % (total / 1e3, len(imports)))
+
+    # a module is listed after the ones it imports
+    direct, children = [], []
+    for entry in imports:
+        if entry[2] == 0:
+            if entry[3] == "main":
+                direct = children
+            children = []
+        elif entry[2] == 1:
+            children.append(entry)
+
+    print("slowest imports of main.py (cumulative ms):")
+    for cum, _, _, name in sorted(direct, reverse=True)[:args.top]:
+        print("  %8.1f  %s" % (cum / 1e3, name))
+
+    loaded = [name for _, _, _, name in imports
+              if any(name == m or name.startswith(m + ".")
+                     for m in REMOTE_ONLY)]
+    if loaded:
+        print("imported though no remote check was done: %s" %
+              ", ".join(loaded))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
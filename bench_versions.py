@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the parsed version cache of Pac: time of the version
+lookups one run does per package (evaluate, its debug line and a notifier),
+with the cache and with it dropped before every lookup as it was before.
+"""
+
+import sys
+import time
+import argparse
+
+from main import version_patch_factory
+from nvnotifier.repo import PKGBUILDPac
+
+
+def make_pacs(n):
+    lvpatch = version_patch_factory(r"[^:]+:(\d+)\.(\d+)-.*", "$1.$2.{name}")
+    rvpatch = version_patch_factory(r"v?(.*)", "$1")
+    pacs = []
+    for i in range(n):
+        pac = PKGBUILDPac("/repo/pkg%d/PKGBUILD" % i,
+                          raw_local_version="1:%d.%d-1" % (i, i % 7),
+                          raw_remote_version="v%d.%d.pkg%d" % (i, i % 9, i))
+        pac.lvpatch = lvpatch
+        pac.rvpatch = rvpatch
+        pacs.append(pac)
+    return pacs
+
+
+def one_run(pacs, cached):
+    for pac in pacs:
+        for lookup in ("version_ready", "out_of_date", "local_version",
+                       "remote_version", "version_ready", "out_of_date"):
+            if not cached:
+                pac._version_cache = {}
+            getattr(pac, lookup)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("-n", "--packages", type=int, default=2000,
+                        help="packages in the run (default: 2000)")
+    parser.add_argument("-r", "--runs", type=int, default=5,
+                        help="runs timed (default: 5)")
+    args = parser.parse_args()
+
+    pacs = make_pacs(args.packages)
+    result = {}
+    for cached in (False, True):
+        best = None
+        for _ in range(args.runs):
+            for pac in pacs:
+                pac._version_cache = {}
+            start = time.perf_counter()
+            one_run(pacs, cached)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        result[cached] = best
+
+    print("%d packages: %.1f ms uncached, %.1f ms cached, %.1f ms saved" %
+          (args.packages, result[False] * 1e3, result[True] * 1e3,
+           (result[False] - result[True]) * 1e3))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
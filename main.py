@@ -6,15 +6,24 @@ import os
 import configparser
 import operator
 import logging
-import atexit
+import subprocess
+import functools
 from collections import OrderedDict
 from types import SimpleNamespace
 from importlib import import_module
 
 import nvchecker.lib.nicelogger as nicelogger
-from serializer import PickledData
+from notifier.lib import convert_timeout_to_second, NotifierQueue
 import nvnotifier.repo as repo
-from nvnotifier.repo import PKGBUILDPac
+import nvnotifier.git as git
+import nvnotifier.helper.pkgbuild as pkgbuild
+from nvnotifier.state import StateStore
+import nvnotifier.inotify as inotify
+from nvnotifier.repo import PKGBUILDPac, SyncDBPac
+from nvnotifier.helper.syncdb import SyncDB
+from nvnotifier.scheduler import RemoteScheduler
+from nvnotifier.aur import AURBatcher
+from nvnotifier.metrics import METRICS
 
 try:
     from xdg.BaseDirectory import xdg_cache_home
@@ -36,9 +45,10 @@ def version_patch_factory(regex_str=None, patch=None):
         patch = regex_str
         regex_str = r".*"
 
+    regex = re.compile(regex_str)
+
     def func(pacinfo, version):
         ret = patch.format(**pacinfo)
-        regex = re.compile(regex_str)
         match = regex.match(version)
 
         if not match:
@@ -76,6 +86,13 @@ def load_config(configpath):
     return rec
 
 
+def in_blacklist(name, pattern_list):
+    if any(p.match(name) for p in pattern_list):
+        logger.debug("%r is in blacklist", name)
+        return True
+    return False
+
+
 def all_pkgbuilds(root, blacklist=[]):
     all_path = set()
     pattern_list = [re.compile("^%s$" % p) for p in blacklist]
@@ -84,19 +101,41 @@ def all_pkgbuilds(root, blacklist=[]):
         relpath = os.path.join(d, "PKGBUILD")
         abspath = os.path.join(root, relpath)
 
-        if os.path.isfile(abspath):
-            if any([p.match(d) for p in pattern_list]):
-                logger.debug("%r is in blacklist", d)
-            else:
-                all_path.add(abspath)
+        if os.path.isfile(abspath) and not in_blacklist(d, pattern_list):
+            all_path.add(abspath)
 
     return all_path
 
 
+def changed_pkgbuilds(root, since):
+    """
+    PKGBUILDs added, modified and deleted (as paths relative to root)
+    since commit `since`, or None when a full rescan is needed
+    """
+    try:
+        if not git.git_is_ancestor(root, since):
+            logger.info("Last scanned commit %s is gone, rescan all", since)
+            return None
+        diff = git.git_diff_from_head(root, since, "*/PKGBUILD")
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+    # only PKGBUILDs directly inside a subdir of root count
+    for k, paths in diff.items():
+        diff[k] = set(p for p in paths if p.count("/") == 1)
+
+    return diff
+
+
 def init_notifiers(conf, saved):
     notifiers = {}
     for name, conf in conf.items():
+        conf = dict(conf)
         try:
+            # options of the dispatch queue, not the notifier
+            queue_size = int(conf.pop("_queue", 64))
+            concurrency = int(conf.pop("_concurrency", 1))
+
             mod = import_module("notifier.%s" % name)
             if name in saved:
                 n = mod.Notifier(saved=saved[name], **conf)
@@ -105,7 +144,7 @@ def init_notifiers(conf, saved):
         except Exception as exp:
             logger.error("Failed to initialize Notifier %r (%s)", name, exp)
         else:
-            notifiers[name] = n
+            notifiers[name] = NotifierQueue(name, n, queue_size, concurrency)
 
     return notifiers
 
@@ -122,134 +161,618 @@ def predicate(a, b):
         return '?'
 
 
-def apply_config(pac, conf):
+def compile_config(conf, check_interval="0s"):
     nvconfig = conf.copy()
+    rule = SimpleNamespace()
 
     try:
         arg = nvconfig.pop("_lvpatch").split("\n")
     except KeyError:
         arg = []
     finally:
-        pac.lvpatch = version_patch_factory(*arg)
+        rule.lvpatch = version_patch_factory(*arg)
 
     try:
         arg = nvconfig.pop("_rvpatch").split("\n")
     except KeyError:
         arg = []
     finally:
-        pac.rvpatch = version_patch_factory(*arg)
+        rule.rvpatch = version_patch_factory(*arg)
+
+    rule.check_od = getattr(operator, nvconfig.pop("_op", ":3"), None)
+    rule.check_interval = convert_timeout_to_second(
+        nvconfig.pop("_check_interval", check_interval))
+    rule.nvconfig = nvconfig
+    return rule
+
+
+def apply_config(pac, rule):
+    pac.lvpatch = rule.lvpatch
+    pac.rvpatch = rule.rvpatch
+    pac.check_od = rule.check_od
+    pac.check_interval = rule.check_interval
+    pac.set_nvconfig(rule.nvconfig)
+
+
+class RuleIndex:
+    """
+    [pkg:regex] sections compiled once. Every section overrides all
+    settings of the ones before it, so only the last matching one counts.
+    Literal names are looked up in a dict, other patterns are tried
+    together as one alternation, last section first.
+    """
+    special = re.compile(r"[\\.^$*+?{}\[\]|()]")
+
+    def __init__(self, pkg_conf, check_interval="0s"):
+        self.rules = []
+        self.literal = {}
+        self.individual = []
+        alternation = []
+
+        for i, (pattern, conf) in enumerate(pkg_conf.items()):
+            self.rules.append(compile_config(conf, check_interval))
+            # same form as in the alternation, a|b is ^(?:a|b)$ either way
+            regex = re.compile("^(?:%s)$" % pattern)
+            if not self.special.search(pattern):
+                self.literal[pattern] = i
+            elif re.search(r"\\\d|\(\?P=", pattern):
+                # back references can't be renumbered into the alternation
+                self.individual.append((i, regex))
+            else:
+                alternation.append((i, pattern, regex))
+
+        self.combined = None
+        if alternation:
+            try:
+                self.combined = re.compile("^(?:%s)$" % "|".join(
+                    "(?P<_rule%d>%s)" % (i, pattern)
+                    for i, pattern, _ in reversed(alternation)))
+            except re.error:
+                self.individual.extend((i, r) for i, _, r in alternation)
+        self.individual.sort(key=lambda e: e[0], reverse=True)
+
+    def lookup(self, name):
+        """index of the last rule matching name, -1 if none"""
+        best = self.literal.get(name, -1)
+
+        if self.combined:
+            m = self.combined.match(name)
+            if m:
+                best = max(best, int(m.lastgroup[len("_rule"):]))
+
+        for i, regex in self.individual:
+            if i <= best:
+                break
+            if regex.match(name):
+                best = i
+                break
+
+        return best
+
+
+def read_changed(pac):
+    """(mtime, content, cached parse) of pac's PKGBUILD, (None,)*3 if same"""
+    mtime = pac.local_change()
+    if mtime is None:
+        return None, None, None
+
+    with open(pac.path, "rb") as fin:
+        data = fin.read()
+    return mtime, data, pkgbuild.PARSE_CACHE.get(pkgbuild.cache_key(data))
+
+
+def timed_phase(name):
+    """count wall time of a Repository coroutine method as phase `name`"""
+    def decorator(func):
+        @functools.wraps(func)
+        @asyncio.coroutine
+        def wrapper(self, *args, **kwargs):
+            with METRICS.phase(self.name, name):
+                return (yield from func(self, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def setup(C, local_executor=None, local_workers=None,
+          metrics_json=None, metrics_prom=None):
+    """process-wide resources shared by all repositories"""
+    # restricted bash coprocesses evaluating PKGBUILDs
+    pkgbuild.set_worker_pool_size(int(C.meta.get("bash_workers", 0)) or None)
+    # PKGBUILDs are read in a thread or process pool, CLI overrides meta
+    repo.set_local_executor(
+        local_executor or C.meta.get("local_executor", "thread"),
+        local_workers or int(C.meta.get("local_workers", 0)) or None)
+    repo.set_remote_workers(int(C.meta.get("vcs_workers", 0)) or None)
+    pkgbuild.load_parse_cache(os.path.join(WORKING_DIR, "pkgbuild.cache"),
+                              int(C.meta.get("parse_cache_size", 20000)))
+
+    # remote checks are throttled per nvchecker source
+    scheduler = RemoteScheduler.from_meta(C.meta)
+    scheduler.add_batcher(
+        "aur", AURBatcher.from_meta(C.meta, scheduler=scheduler))
+
+    # metrics files written after each run, CLI overrides meta
+    confdir = os.path.dirname(C.path)
+    metrics = [path or (C.meta.get(key) and
+                        os.path.join(confdir, C.meta[key]))
+               for path, key in ((metrics_json, "metrics_json"),
+                                 (metrics_prom, "metrics_prom"))]
+
+    return SimpleNamespace(scheduler=scheduler, metrics=metrics)
+
+
+def write_metrics(shared):
+    try:
+        METRICS.write(*shared.metrics)
+    except OSError as exp:
+        logger.error("Cannot write metrics (%s)", exp)
+
+
+class Repository:
+    """A PKGBUILD repository described by config C"""
+
+    def __init__(self, C, shared):
+        self.C = C
+        self.name = C.meta["name"]
+        self.shared = shared
+        confdir = os.path.dirname(C.path)
+
+        # local versions come from a sync db instead of PKGBUILDs
+        self.syncdb = None
+        if C.meta.get("syncdb"):
+            self.syncdb = SyncDB(
+                os.path.abspath(os.path.join(confdir, C.meta["syncdb"])),
+                cache=os.path.join(WORKING_DIR, self.name + ".syncdb"))
+
+        # root isn't needed to read a sync db
+        root = C.meta.get("root", ".") if self.syncdb else C.meta["root"]
+        self.root = os.path.abspath(os.path.join(confdir, root))
+        self.blacklist = C.meta.get("blacklist", "").split('\n')
+        self.pattern_list = [re.compile("^%s$" % p) for p in self.blacklist]
+        self.rules = RuleIndex(C.pkg, C.meta.get("check_interval", "0s"))
+        self.rule_cache = None
+
+        state_file = os.path.join(WORKING_DIR, self.name + ".sqlite")
+        legacy_file = os.path.join(WORKING_DIR, self.name + ".db")
+        self.store = StateStore(state_file, legacy=legacy_file)
+
+        self.pacs = OrderedDict()
+        self.git_index = None
+        self.scan_head = None
+        self.out_of_date = self.store.get_status("out_of_date")
+        self.not_ready = self.store.get_status("not_ready")
+        self.lock = asyncio.Lock()
+
+    def configure(self, pacs):
+        # apply package specific config
+        # package -> rule results are cached until the config file changes
+        stat = os.stat(self.C.path)
+        key = (os.path.abspath(self.C.path), stat.st_mtime, stat.st_size)
+        if self.rule_cache is None:
+            self.rule_cache = self.store.get("rule_cache")
+        if self.rule_cache is None or self.rule_cache["key"] != key:
+            self.rule_cache = {"key": key, "rules": {}}
+
+        cached = self.rule_cache["rules"]
+        changed = False
+        for pac in pacs:
+            i = cached.get(pac.name)
+            if i is None:
+                i = cached[pac.name] = self.rules.lookup(pac.name)
+                changed = True
+            if i >= 0:
+                apply_config(pac, self.rules.rules[i])
+
+        if changed:
+            self.store.set("rule_cache", self.rule_cache)
+
+    def refresh_git(self):
+        # one walk of git history instead of a `git log` per PKGBUILD
+        try:
+            self.git_index = git.git_build_index(
+                self.root, saved=self.git_index or self.store.get("git_index"))
+        except (subprocess.CalledProcessError, OSError):
+            logger.info("%r is not a git repository", self.root)
+            self.git_index = None
+
+        # scan incrementally when the tree is clean and the last scan is known
+        self.scan_head = None
+        if self.git_index is not None and git.git_is_clean(self.root):
+            self.scan_head = self.git_index["head"]
+        else:
+            logger.info("%r is dirty or not a git repository", self.root)
+
+    def load_syncdb(self):
+        """Pacs of packages in the sync db, all of them checked locally"""
+        self.syncdb.refresh()
+        saved = dict((info["name"], info) for info in self.store.paclist())
+
+        pacs = OrderedDict()
+        for name in sorted(self.syncdb):
+            if in_blacklist(name, self.pattern_list):
+                continue
+            pac = self.pacs.get(name)
+            if pac is None:
+                if name in saved:
+                    pac = SyncDBPac(syncdb=self.syncdb, **saved[name])
+                else:
+                    pac = SyncDBPac(name, self.syncdb)
+            pacs[name] = pac
+
+        new = [pac for name, pac in pacs.items() if name not in self.pacs]
+        self.pacs = pacs
+        self.configure(new)
+        return list(pacs.values())
+
+    def load(self):
+        """generate list of Pacs, return the ones to check locally"""
+        if self.syncdb:
+            return self.load_syncdb()
+
+        # Pacs saved while local versions came from a sync db have no path
+        saved_paclist = [info for info in self.store.paclist()
+                         if info.get("path")]
+        saved_head = self.store.get("head")
+        self.refresh_git()
+
+        changes = None
+        # saved paths are absolute, a moved root needs a full scan
+        if self.scan_head and saved_head and \
+           self.store.get("blacklist") == self.blacklist and \
+           self.store.get("root") == self.root:
+            changes = changed_pkgbuilds(self.root, saved_head)
+
+        if changes is None:
+            pkgbuilds = all_pkgbuilds(self.root, self.blacklist)
+            stale = pkgbuilds.copy()
+        else:
+            pkgbuilds = set(info["path"] for info in saved_paclist)
+            pkgbuilds.difference_update(
+                os.path.join(self.root, p) for p in changes["D"])
+            stale = set()
+            for relpath in changes["A"] | changes["M"]:
+                abspath = os.path.join(self.root, relpath)
+                if os.path.isfile(abspath) and not in_blacklist(
+                        os.path.dirname(relpath), self.pattern_list):
+                    stale.add(abspath)
+            pkgbuilds |= stale
+            logger.info("%d PKGBUILDs changed since %s",
+                        len(stale), saved_head)
+
+        for info in filter(lambda e: e["path"] in pkgbuilds, saved_paclist):
+            pkgbuilds.remove(info["path"])
+            pac = PKGBUILDPac(**info)
+            self.pacs[pac.name] = pac
+            # never successfully parsed, try again
+            if info.get("mtime") is None:
+                stale.add(pac.path)
+
+        for path in pkgbuilds:
+            pac = PKGBUILDPac(path)
+            self.pacs[pac.name] = pac
+            stale.add(pac.path)
+
+        self.configure(self.pacs.values())
+        return [pac for pac in self.pacs.values() if pac.path in stale]
+
+    @timed_phase("local")
+    @asyncio.coroutine
+    def update_local(self, pacs):
+        if self.syncdb:
+            # only dict lookups, not worth a thread
+            for pac in pacs:
+                pac.update_local()
+        elif repo.LOCAL_EXECUTOR == "process":
+            tasks = [asyncio.ensure_future(self.parse_in_process(pac))
+                     for pac in pacs]
+            if tasks:
+                yield from asyncio.wait(tasks)
+        else:
+            loop = asyncio.get_event_loop()
+            tasks = [loop.run_in_executor(repo.local_executor(),
+                                          pac.update_local)
+                     for pac in pacs]
+            if tasks:
+                yield from asyncio.wait(tasks)
+        logger.info("%s: Finished checking local versions.", self.name)
+        pkgbuild.PARSE_CACHE.save()
+
+        # save point
+        self.store.save_pacs(pac.info for pac in self.pacs.values())
+        self.store.set("git_index", self.git_index)
+        self.store.set("head", self.scan_head)
+        self.store.set("blacklist", self.blacklist)
+        self.store.set("root", self.root)
+
+    @asyncio.coroutine
+    def parse_in_process(self, pac):
+        # git and the parse cache stay in this process, only cache misses
+        # are sent to the pool and come back as plain dicts
+        loop = asyncio.get_event_loop()
+        mtime, data, d = yield from loop.run_in_executor(
+            None, read_changed, pac)
+        if mtime is None:
+            return
+
+        if d is None:
+            d = yield from loop.run_in_executor(
+                repo.local_executor(), pkgbuild.parse_pkgbuild_data, data)
+            if d:
+                pkgbuild.PARSE_CACHE.put(pkgbuild.cache_key(data), d)
+
+        pac.merge_local(mtime, d)
+
+    @timed_phase("remote")
+    @asyncio.coroutine
+    def update_remote(self, force_remote=False):
+        # skip packages checked recently enough
+        pacs = [pac for pac in self.pacs.values()
+                if force_remote or not pac.remote_fresh]
+        logger.info("%s: %d packages to check remotely (%d skipped)",
+                    self.name, len(pacs), len(self.pacs) - len(pacs))
+
+        yield from self.shared.scheduler.run_all(pacs)
+        logger.info("%s: Finished checking remote versions.", self.name)
+
+        # save point
+        self.store.save_pacs(pac.info for pac in self.pacs.values())
+
+    def evaluate(self):
+        """search for out-of-date Pacs and Pacs with incomplete version"""
+        not_ready = {}
+        out_of_date = {}
+        for pac in self.pacs.values():
+            lv = pac.local_version
+            rv = pac.remote_version
+            logger.debug("{name} | {lv} ({raw_local_version}) "
+                         "{pred} {rv} ({raw_remote_version})".format(
+                             lv=lv, rv=rv, pred=predicate(lv, rv), **pac.info))
+
+            if not pac.version_ready:
+                not_ready[pac.name] = \
+                    self.not_ready.get(pac.name, repo.TIMESTAMP)
+                if pac.name in self.out_of_date:
+                    out_of_date[pac.name] = self.out_of_date[pac.name]
+            elif pac.out_of_date:
+                out_of_date[pac.name] = \
+                    self.out_of_date.get(pac.name, repo.TIMESTAMP)
+
+        self.out_of_date = out_of_date
+        self.not_ready = not_ready
+
+        # save point
+        self.store.save_status("out_of_date", out_of_date)
+        self.store.save_status("not_ready", not_ready)
+
+    @timed_phase("notify")
+    @asyncio.coroutine
+    def notify(self):
+        saved = self.store.notifiers()
+        notifiers = init_notifiers(self.C.notifier, dict(
+            (name, self.store.get_notifier_data(name)) for name in saved))
+
+        # out-of-date Pacs go to all notifiers in parallel
+        items = [(self.pacs[name], since)
+                 for name, since in self.out_of_date.items()
+                 if name in self.pacs]
+        tasks = [asyncio.ensure_future(notifier.dispatch(items))
+                 for notifier in notifiers.values()]
 
-    pac.check_od = getattr(operator, nvconfig.pop("_op", ":3"), None)
-    pac.set_nvconfig(nvconfig)
+        try:
+            if tasks:
+                yield from asyncio.wait(tasks)
+        finally:
+            # last save point: when I crash, save notifier_data as well
+            # ensure that user's mailbox won't be flood
+            for nname, notifier in notifiers.items():
+                try:
+                    data = yield from notifier.finish()
+                    self.store.save_notifier_data(nname, data)
+                except Exception as exp:
+                    logger.error("Notifier %s failed to produce "
+                                 "notifier_data (%s)", nname, exp)
+            logger.debug("Finish saving notifier_data")
+
+    @asyncio.coroutine
+    def check(self, noremote=False, force_remote=False):
+        with (yield from self.lock):
+            with METRICS.phase(self.name, "discovery"):
+                stale = self.load()
+            if not noremote:
+                remote_task = asyncio.ensure_future(
+                    self.update_remote(force_remote))
+
+            yield from self.update_local(stale)
+            if not noremote:
+                yield from remote_task
+
+            self.evaluate()
+            yield from self.notify()
+
+    @asyncio.coroutine
+    def recheck_local(self, paths, full=False):
+        """re-check PKGBUILDs at paths, or all of them if full is True"""
+        with (yield from self.lock):
+            repo.refresh_timestamp()
+            if self.syncdb:
+                yield from self.update_local(self.load_syncdb())
+                self.evaluate()
+                yield from self.notify()
+                return
+
+            self.refresh_git()
+
+            if full:
+                paths = set(paths) | all_pkgbuilds(self.root, self.blacklist)
+                paths.update(pac.path for pac in self.pacs.values())
+
+            pacs = []
+            for path in paths:
+                name = os.path.basename(os.path.dirname(path))
+                if not os.path.isfile(path) or \
+                   in_blacklist(name, self.pattern_list):
+                    if self.pacs.pop(name, None) is not None:
+                        logger.info("%s: %r is removed", self.name, name)
+                    continue
+
+                pac = self.pacs.get(name)
+                if pac is None:
+                    pac = self.pacs[name] = PKGBUILDPac(path)
+                    self.configure([pac])
+                pacs.append(pac)
+
+            yield from self.update_local(pacs)
+            self.evaluate()
+            yield from self.notify()
+
+    @asyncio.coroutine
+    def recheck_remote(self):
+        with (yield from self.lock):
+            yield from self.update_remote()
+            self.evaluate()
+            yield from self.notify()
+
+
+def log_failure(task, what):
+    """make task log its exception when done, as "Failed to <what>" """
+    def callback(task):
+        if not task.cancelled() and task.exception():
+            logger.error("Failed to %s (%r)", what, task.exception())
+    task.add_done_callback(callback)
+    return task
+
+
+class RepositoryWatcher:
+    """re-check PKGBUILDs of a Repository when they change on disk"""
+    ROOT_MASK = inotify.IN_CREATE | inotify.IN_DELETE | \
+        inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO | inotify.IN_ONLYDIR
+    DIR_MASK = inotify.IN_CLOSE_WRITE | inotify.IN_CREATE | \
+        inotify.IN_DELETE | inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO
+
+    def __init__(self, repository, delay=2):
+        self.repository = repository
+        self.root = repository.root
+        self.delay = delay
+        self.dirty = set()
+        self.full = False
+        self.handle = None
+        self.loop = asyncio.get_event_loop()
+
+        self.inotify = inotify.Inotify()
+        if repository.syncdb:
+            # the db is replaced or rewritten as a whole
+            self.dbdir, self.dbname = os.path.split(repository.syncdb.filename)
+            self.inotify.add_watch(self.dbdir, self.DIR_MASK)
+        else:
+            self.dbdir = self.dbname = None
+            self.inotify.add_watch(self.root, self.ROOT_MASK)
+            for d in os.listdir(self.root):
+                self.watch_dir(d)
+        self.loop.add_reader(self.inotify.fileno(), self.on_events)
 
+    def watch_dir(self, d):
+        path = os.path.join(self.root, d)
+        if d.startswith(".") or not os.path.isdir(path):
+            return
+
+        try:
+            self.inotify.add_watch(path, self.DIR_MASK)
+        except OSError as exp:
+            logger.warning("Cannot watch %r (%s)", path, exp)
+
+    def on_events(self):
+        for path, mask, name in self.inotify.read():
+            if mask & inotify.IN_Q_OVERFLOW:
+                self.full = True
+            elif self.dbdir is not None:
+                if path == self.dbdir and name == self.dbname:
+                    self.full = True
+            elif path == self.root and mask & inotify.IN_ISDIR:
+                if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                    self.watch_dir(name)
+                self.dirty.add(os.path.join(self.root, name, "PKGBUILD"))
+            elif path and name == "PKGBUILD":
+                self.dirty.add(os.path.join(path, name))
+
+        # wait until the tree settles (e.g. git pull is finished)
+        if self.dirty or self.full:
+            if self.handle is not None:
+                self.handle.cancel()
+            self.handle = self.loop.call_later(self.delay, self.flush)
+
+    def flush(self):
+        paths, full = self.dirty, self.full
+        self.dirty, self.full, self.handle = set(), False, None
+        logger.info("%s: %d PKGBUILDs changed on disk",
+                    self.repository.name, len(paths))
+        log_failure(
+            asyncio.ensure_future(self.repository.recheck_local(paths, full)),
+            "re-check %s" % self.repository.name)
+
+    def close(self):
+        self.loop.remove_reader(self.inotify.fileno())
+        self.inotify.close()
+
+
+@asyncio.coroutine
+def daemon(shared, repos, interval, noremote=False, force_remote=False):
+    """
+    Keep running: re-check PKGBUILDs as they change and check remote
+    versions every `interval` seconds
+    """
+    yield from asyncio.wait([log_failure(asyncio.ensure_future(
+        r.check(noremote, force_remote)), "check %s" % r.name)
+        for r in repos])
+    write_metrics(shared)
+    watchers = [RepositoryWatcher(r) for r in repos]
 
-def main(C, noremote=False):
-    cache_file = os.path.join(WORKING_DIR, C.meta["name"] + ".db")
-    root = os.path.abspath(
-                os.path.join(os.path.dirname(C.path), C.meta["root"]))
+    try:
+        while True:
+            yield from asyncio.sleep(interval)
+            # local rechecks since the last round are included
+            if noremote:
+                write_metrics(shared)
+                continue
+
+            repo.refresh_timestamp()
+            shared.scheduler.forget()
+            yield from asyncio.wait([log_failure(asyncio.ensure_future(
+                r.recheck_remote()), "check %s" % r.name) for r in repos])
+            write_metrics(shared)
+    finally:
+        for w in watchers:
+            w.close()
 
-    # load saved session data
-    D = SimpleNamespace()
-    with PickledData(cache_file, default={}) as pickled:
-        D.paclist = pickled.get("paclist", [])
-        D.out_of_date = pickled.get("out_of_date", {})
-        D.not_ready = pickled.get("not_ready", {})
 
-    # generate list of Pacs
-    paclist = []
-    pkgbuilds = all_pkgbuilds(root, C.meta.get("blacklist", "").split('\n'))
+def main(configs, noremote=False, force_remote=False, daemon_interval=None,
+         local_executor=None, local_workers=None,
+         metrics_json=None, metrics_prom=None):
+    # all repositories share one event loop, HTTP clients and scheduler
+    shared = setup(configs[0], local_executor, local_workers,
+                   metrics_json, metrics_prom)
     repo.refresh_timestamp()
-    for info in filter(lambda e: e["path"] in pkgbuilds, D.paclist):
-        pkgbuilds.remove(info["path"])
-        pac = PKGBUILDPac(**info)
-        paclist.append(pac)
-
-    for path in pkgbuilds:
-        pac = PKGBUILDPac(path)
-        paclist.append(pac)
-
-    # apply package specific config
-    for pattern, conf in C.pkg.items():
-        regex = re.compile("^" + pattern + "$")
-        for pac in paclist:
-            if regex.match(pac.name):
-                apply_config(pac, conf)
-
-    # async update local and remote version
-    update_local_tasks = []
-    update_remote_tasks = []
-    loop = asyncio.get_event_loop()
-
-    for pac in paclist:
-        t1 = loop.run_in_executor(None, pac.update_local)
-        update_local_tasks.append(t1)
-        if not noremote:
-            t2 = asyncio.async(pac.async_update_remote())
-            update_remote_tasks.append(t2)
-
-    if update_local_tasks:
-        loop.run_until_complete(asyncio.wait(update_local_tasks))
-    logger.info("Finished checking local versions.")
-
-    if update_remote_tasks:
-        loop.run_until_complete(asyncio.wait(update_remote_tasks))
-    logger.info("Finished checking remote versions.")
-
-    # save point
-    with PickledData(cache_file, default={}) as pickled:
-        pickled["paclist"] = [pac.info for pac in paclist]
-
-    # search for out-of-date Pacs and Pacs with incomplete version record
-    not_ready = {}
-    out_of_date = {}
-    for pac in paclist:
-        lv = pac.local_version
-        rv = pac.remote_version
-        logger.debug("{name} | {lv} ({raw_local_version}) "
-                     "{pred} {rv} ({raw_remote_version})".format(
-                         lv=lv, rv=rv, pred=predicate(lv, rv), **pac.info))
-
-        if not pac.version_ready:
-            not_ready[pac.name] = D.not_ready.get(pac.name, repo.TIMESTAMP)
-            if pac.name in D.out_of_date:
-                out_of_date[pac.name] = D.out_of_date[pac.name]
-        elif pac.out_of_date:
-            out_of_date[pac.name] = D.out_of_date.get(pac.name, repo.TIMESTAMP)
-
-    # save point
-    with PickledData(cache_file, default={}) as pickled:
-        D.notifier_data = pickled.get("notifier_data", {})
-        pickled["out_of_date"] = out_of_date
-        pickled["not_ready"] = not_ready
-
-    notifiers = init_notifiers(C.notifier, D.notifier_data)
-
-    # last save point: when I crash, save notifier_data as well
-    # ensure that user's mailbox won't be flood
-    def save_notifier_data():
-        notifier_data = D.notifier_data
-        for name, notifier in notifiers.items():
-            try:
-                notifier_data[name] = notifier.finish()
-            except Exception as exp:
-                logger.error("Notifier %s failed to produce notifier_data (%s)"
-                             % (name, exp))
 
-        with PickledData(cache_file, default={}) as pickled:
-            pickled["notifier_data"] = notifier_data
+    loop = asyncio.get_event_loop()
+    repos = [Repository(C, shared) for C in configs]
 
-        logger.debug("Finish saving notifier_data")
+    if daemon_interval is not None:
+        try:
+            loop.run_until_complete(daemon(
+                shared, repos, daemon_interval, noremote, force_remote))
+        finally:
+            for r in repos:
+                r.store.close()
+        return
 
-    atexit.register(save_notifier_data)
+    tasks = [asyncio.ensure_future(r.check(noremote, force_remote))
+             for r in repos]
+    loop.run_until_complete(asyncio.wait(tasks))
 
-    # send out-of-date Pacs to notifiers
-    for pac in filter(lambda p: p.name in out_of_date, paclist):
-        for name, notifier in notifiers.items():
-            try:
-                notifier.send(pac, out_of_date[pac.name])
-            except Exception as exp:
-                logger.error("Failed to send notification of %s "
-                             "via Notifier %s (%s)", pac, name, exp)
+    for r, task in zip(repos, tasks):
+        if task.exception():
+            logger.error("Failed to check %s (%r)", r.name, task.exception())
+        r.store.close()
+    write_metrics(shared)
 
 
 if __name__ == "__main__":
@@ -258,14 +781,35 @@ if __name__ == "__main__":
     os.makedirs(WORKING_DIR, exist_ok=True)
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("config", type=load_config,
-                        help="INI format config file")
+    parser.add_argument("config", type=load_config, nargs="+",
+                        help="INI format config file(s)")
     parser.add_argument("-v", "--verbose", action="count", default=0,
                         help="increase output verbosity")
     parser.add_argument("-n", "--noremote", action="store_true",
                         help="don't update remote version")
+    parser.add_argument("-f", "--force-remote", action="store_true",
+                        help="update remote version ignoring check interval")
+    parser.add_argument("-d", "--daemon", action="store_true",
+                        help="keep running, re-check PKGBUILDs on change")
+    parser.add_argument("-i", "--interval", default="1h",
+                        type=convert_timeout_to_second,
+                        help="remote check interval in daemon mode")
+    parser.add_argument("--local-executor", choices=repo.LOCAL_EXECUTORS,
+                        help="pool reading PKGBUILDs (default: thread)")
+    parser.add_argument("--local-workers", type=int,
+                        help="size of the pool reading PKGBUILDs")
+    parser.add_argument("--metrics-json", metavar="PATH",
+                        help="write timing and latency metrics as JSON")
+    parser.add_argument("--metrics-prom", metavar="PATH",
+                        help="write metrics as a Prometheus textfile")
 
     args = parser.parse_args()
     nicelogger.enable_pretty_logging(
         ["WARNING", "INFO", "DEBUG"][min(args.verbose, 2)])
-    main(args.config, noremote=args.noremote)
+    main(args.config, noremote=args.noremote,
+         force_remote=args.force_remote,
+         daemon_interval=args.interval if args.daemon else None,
+         local_executor=args.local_executor,
+         local_workers=args.local_workers,
+         metrics_json=args.metrics_json,
+         metrics_prom=args.metrics_prom)
@@ -1,14 +1,21 @@
 import requests
 import datetime
+import asyncio
+import functools
+import time
 import re
 import os
 import logging
 from urllib.parse import urljoin
 
-from .lib import convert_timeout_to_second
+from .lib import convert_timeout_to_second, load_digests
 
 logger = logging.getLogger(__name__)
 GITHUB_API_BASE = "https://api.github.com/"
+REQUEST_TIMEOUT = 60
+ISSUE_CACHE_KEY = ":issues"
+# retry queue of earlier versions, the record alone does it now
+PENDING_KEY = ":pending"
 
 
 class GitHubAPIException(Exception):
@@ -31,50 +38,193 @@ class Notifier:
         self.session.headers.update({'Authorization': "token %s" % token})
 
         self.repo = repo
-        self.record = saved.copy()
+        self.api_base = kwargs.get("api_base", GITHUB_API_BASE)
+
+        # conditional requests of the issue list pages are cached here
+        saved = dict(saved)
+        self.issue_cache = saved.pop(ISSUE_CACHE_KEY, {})
+        saved.pop(PENDING_KEY, None)
+        self.record = load_digests(saved)
+
+        # issues are created one at a time, at least post_interval apart,
+        # waiting at most max_wait for GitHub's rate limit to reset
+        self.post_lock = asyncio.Lock()
+        self.post_interval = convert_timeout_to_second(
+            kwargs.get("post_interval", "1s"))
+        self.max_wait = convert_timeout_to_second(
+            kwargs.get("max_wait", "1m"))
+        self.next_post = 0
+
+        # package name -> number of out-of-date issue, read on first send
+        self.odissues = None
+        self.index_error = None
+        self.index_lock = asyncio.Lock()
+
+    def get_page(self, url):
+        """(issues, url of next page), reuse the cached page if not modified"""
+        cached = self.issue_cache.get(url)
+        headers = {}
+        if cached:
+            headers["If-None-Match"] = cached["etag"]
+
+        req = self.session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        if req.status_code == 304 and cached:
+            return cached["issues"], cached["next"]
 
-        url = urljoin(GITHUB_API_BASE, "repos/%s/issues?state=open" % repo)
-        req = self.session.get(url)
         issue_list = req.json()
-
         if not isinstance(issue_list, list):
-            raise GitHubAPIException("Failed to get issue list of %s" % repo)
-
+            raise GitHubAPIException(
+                "Failed to get issue list of %s" % self.repo)
+
+        issues = [(issue["number"], issue["title"]) for issue in issue_list]
+        next_url = req.links.get("next", {}).get("url")
+        if "ETag" in req.headers:
+            self.issue_cache[url] = {
+                "etag": req.headers["ETag"],
+                "issues": issues,
+                "next": next_url,
+            }
+        return issues, next_url
+
+    def open_issues(self):
+        url = urljoin(self.api_base,
+                      "repos/%s/issues?state=open&per_page=100" % self.repo)
+        pages = {}
+        while url and url not in pages:
+            issues, next_url = self.get_page(url)
+            pages[url] = issues
+            url = next_url
+
+        # pages that are gone don't need to be cached
+        self.issue_cache = dict((url, page) for url, page in
+                                self.issue_cache.items() if url in pages)
+        return [issue for issues in pages.values() for issue in issues]
+
+    def index_issues(self):
+        odissues = {}
         regex = re.compile("out\W*of\W*date", re.I)
-        self.odtitles = []
-        for issue in issue_list:
-            title = issue['title']
+        for number, title in self.open_issues():
             if regex.search(title):
-                self.odtitles.append(title)
-
-    def send(self, pac, outtime):
+                for word in title.split():
+                    odissues.setdefault(word, number)
+        return odissues
+
+    @asyncio.coroutine
+    def load_issues(self):
+        """
+        read open issues once, in the executor not to block the loop.
+        False if they can't be read, issues would be opened again then.
+        """
+        with (yield from self.index_lock):
+            if self.odissues is None and self.index_error is None:
+                loop = asyncio.get_event_loop()
+                try:
+                    self.odissues = yield from loop.run_in_executor(
+                        None, self.index_issues)
+                except (GitHubAPIException, requests.RequestException,
+                        ValueError) as exp:
+                    logger.error("Failed to get issue list of %s (%s)",
+                                 self.repo, exp)
+                    self.index_error = exp
+
+        return self.odissues is not None
+
+    def wanted(self, pac, outtime):
         if outtime > self.deadline:
             return False
 
-        objhash = pac.info
-        if self.record.get(pac.name) == objhash:
+        if self.record.get(pac.name) == pac.digest:
             logger.info("%r has been marked out-of-date in GitHub", pac.name)
             return False
 
-        regex = re.compile("(\s|^)%s(\s|$)" % pac.name)
-        for title in self.odtitles:
-            if regex.search(title):
-                logger.info("%r has been marked out-of-date in GitHub",
-                            pac.name)
-                return False
+        if pac.name in self.odissues:
+            logger.info("%r has been marked out-of-date in GitHub (#%s)",
+                        pac.name, self.odissues[pac.name])
+            return False
+
+        return True
+
+    def rate_limit_wait(self, req):
+        """seconds to wait before the next POST, None if not limited"""
+        now = time.time()
+        if "Retry-After" in req.headers:
+            return float(req.headers["Retry-After"])
+        if req.headers.get("X-RateLimit-Remaining") == "0":
+            reset = float(req.headers.get("X-RateLimit-Reset", now + 60))
+            return max(reset - now, 0)
+        if req.status_code == 429 or (req.status_code == 403 and
+                                      "rate limit" in req.text.lower()):
+            # secondary rate limit without a hint
+            return 60.0
+        return None
+
+    @asyncio.coroutine
+    def create_issue(self, data):
+        """POST an issue, return it or None if it must be retried later"""
+        loop = asyncio.get_event_loop()
+        url = urljoin(self.api_base, "repos/%s/issues" % self.repo)
+
+        with (yield from self.post_lock):
+            for attempt in range(2):
+                delay = self.next_post - loop.time()
+                if delay > self.max_wait:
+                    logger.info("GitHub rate limit, defer %r", data["title"])
+                    return None
+                if delay > 0:
+                    yield from asyncio.sleep(delay)
+
+                try:
+                    req = yield from loop.run_in_executor(
+                        None, functools.partial(
+                            self.session.post, url, json=data,
+                            timeout=REQUEST_TIMEOUT))
+                except requests.RequestException as exp:
+                    logger.error("Failed to create issue %r (%s)",
+                                 data["title"], exp)
+                    return None
+
+                wait = self.rate_limit_wait(req)
+                self.next_post = loop.time() + max(wait or 0,
+                                                   self.post_interval)
+                if req.status_code == 201:
+                    return req.json()
+                if wait is None:
+                    logger.error("Failed to create issue %r (HTTP %d)",
+                                 data["title"], req.status_code)
+                    return None
+
+        return None
+
+    @asyncio.coroutine
+    def post(self, name, digest, data):
+        # not recorded if it failed or was deferred, so it's tried again
+        # in the next run if the package is still out-of-date
+        issue = yield from self.create_issue(data)
+        if issue is None:
+            return False
+
+        logger.info("new issue: %r", data["title"])
+        self.record[name] = digest
+        self.odissues[name] = issue.get("number")
+        return True
+
+    @asyncio.coroutine
+    def async_send(self, pac, outtime):
+        if not (yield from self.load_issues()):
+            return False
+
+        if not self.wanted(pac, outtime):
+            return False
 
-        url = urljoin(GITHUB_API_BASE, "repos/%s/issues" % self.repo)
         data = {
             "title": "%s is out-of-date" % pac.name,
             "body": "Local version: %s\n"
                     "Remote version: %s"
                     % (pac.local_version, pac.remote_version)}
-        req = self.session.post(url, json=data)
-
-        if "title" in req.json():
-            logger.info("new issue: %r", data["title"])
-            self.record[pac.name] = objhash
-            return True
+        return (yield from self.post(pac.name, pac.digest, data))
 
-    def finish(self):
-        return self.record
+    @asyncio.coroutine
+    def async_finish(self):
+        record = self.record.copy()
+        record[ISSUE_CACHE_KEY] = self.issue_cache
+        return record
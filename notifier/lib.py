@@ -1,5 +1,11 @@
 from datetime import timedelta
 import re
+import asyncio
+import logging
+
+from nvnotifier.repo import info_digest
+
+logger = logging.getLogger(__name__)
 
 
 def convert_timeout_to_second(s):
@@ -13,3 +19,73 @@ def convert_timeout_to_second(s):
         return td.total_seconds()
     else:
         raise ValueError("Cannot understand timeout: %s" % s)
+
+
+def load_digests(saved):
+    """
+    records of notified Pacs, info dicts saved by older versions are
+    converted to digests
+    """
+    return dict((name, info_digest(value) if isinstance(value, dict)
+                 else value) for name, value in saved.items())
+
+
+class NotifierQueue:
+    """
+    Feed (pac, outtime) to a notifier through a bounded queue served by
+    `concurrency` workers, so a slow notifier doesn't hold up others.
+
+    A notifier may provide coroutines async_send / async_finish, otherwise
+    its send / finish run in the default executor.
+    """
+
+    def __init__(self, name, notifier, queue_size=64, concurrency=1,
+                 loop=None):
+        self.name = name
+        self.notifier = notifier
+        self.loop = loop or asyncio.get_event_loop()
+        self.queue = asyncio.Queue(queue_size)
+        self.concurrency = concurrency
+
+    @asyncio.coroutine
+    def send(self, pac, outtime):
+        if hasattr(self.notifier, "async_send"):
+            return (yield from self.notifier.async_send(pac, outtime))
+        return (yield from self.loop.run_in_executor(
+            None, self.notifier.send, pac, outtime))
+
+    @asyncio.coroutine
+    def finish(self):
+        if hasattr(self.notifier, "async_finish"):
+            return (yield from self.notifier.async_finish())
+        return (yield from self.loop.run_in_executor(
+            None, self.notifier.finish))
+
+    @asyncio.coroutine
+    def _worker(self):
+        while True:
+            item = yield from self.queue.get()
+            if item is None:
+                return
+
+            pac, outtime = item
+            try:
+                yield from self.send(pac, outtime)
+            except Exception as exp:
+                logger.error("Failed to send notification of %s "
+                             "via Notifier %s (%s)", pac, self.name, exp)
+
+    @asyncio.coroutine
+    def dispatch(self, items):
+        """send every (pac, outtime) of items, finish() is not called"""
+        workers = [asyncio.ensure_future(self._worker())
+                   for _ in range(self.concurrency)]
+        try:
+            for item in items:
+                yield from self.queue.put(item)
+            for _ in workers:
+                yield from self.queue.put(None)
+            yield from asyncio.wait(workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
@@ -1,29 +1,24 @@
+import socket
 import smtplib
 import datetime
 import logging
+import threading
+from collections import OrderedDict
 from email.mime.multipart import MIMEMultipart
 
 from nvnotifier import git
-from .lib import convert_timeout_to_second
+from .lib import convert_timeout_to_second, load_digests
 
 logger = logging.getLogger(__name__)
 
 
-def send_mail(host, port, sender, receiver, subject, text):
+def make_mail(sender, receiver, subject, text):
     msg = MIMEMultipart()
     msg['Subject'] = subject
     msg['From'] = sender
     msg['To'] = receiver
     msg.preamble = text
-
-    try:
-        s = smtplib.SMTP(host, port)
-    except ConnectionRefusedError:
-        logger.error("Cannot connect to SMTP server %s:%s", host, port)
-        raise
-
-    s.send_message(msg)
-    s.quit()
+    return msg
 
 
 class Notifier:
@@ -38,18 +33,53 @@ class Notifier:
         self.host = kwargs.get("host", "localhost")
         self.port = kwargs.get("port", 0)
 
-        self.record = saved.copy()
+        # one mail per committer listing all their packages, sent in finish
+        self.digest = str(kwargs.get("digest", "")).lower() in \
+            ("1", "yes", "true", "on")
+        self.digests = OrderedDict()
+
+        # one SMTP connection for all mails of this run
+        self.smtp = None
+        self.smtp_lock = threading.Lock()
+
+        self.record = load_digests(saved)
+
+    def connect(self):
+        try:
+            self.smtp = smtplib.SMTP(self.host, self.port)
+        except ConnectionRefusedError:
+            logger.error("Cannot connect to SMTP server %s:%s",
+                         self.host, self.port)
+            raise
+
+    def disconnect(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except smtplib.SMTPException:
+                self.smtp.close()
+            self.smtp = None
 
     def send_raw_mail(self, receiver, subject, text):
         receiver = receiver or self.default_receiver
-
-        send_mail(
-            host=self.host,
-            port=self.port,
-            sender=self.sender,
-            receiver=receiver,
-            subject=subject,
-            text=text)
+        msg = make_mail(self.sender, receiver, subject, text)
+
+        with self.smtp_lock:
+            if self.smtp is None:
+                self.connect()
+
+            try:
+                self.smtp.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError,
+                    socket.timeout):
+                # the server may drop an idle connection, reconnect once.
+                # Other SMTPExceptions (OSErrors too) are not retried, the
+                # mail may have been accepted by some recipients.
+                logger.info("Reconnect to SMTP server %s:%s",
+                            self.host, self.port)
+                self.smtp.close()
+                self.connect()
+                self.smtp.send_message(msg)
 
         logger.info("Sent Email to %r", receiver)
         logger.debug("Subject: %r", subject)
@@ -58,24 +88,56 @@ class Notifier:
         if outtime > self.deadline:
             return False
 
-        objhash = pac.info
+        objhash = pac.digest
         if self.record.get(pac.name) == objhash:
             logger.info("Already sent mail to %r maintainer", pac.name)
             return False
 
-        receiver = git.git_latest_committer(pac.path) or self.default_receiver
-        if receiver:
-            self.send_raw_mail(
-                receiver=receiver,
-                subject="Package %s is out-of-date" % pac.name,
-                text="Local: %s\nRemote: %s" %
-                     (pac.local_version, pac.remote_version))
-        else:
+        # only PKGBUILDs have a committer
+        path = getattr(pac, "path", None)
+        receiver = (path and git.git_latest_committer(path)) or \
+            self.default_receiver
+        if not receiver:
             logger.warning("Don't know send email to whom (%s)", pac)
             return False
 
+        if self.digest:
+            self.digests.setdefault(receiver, []).append(pac)
+            return True
+
+        self.send_raw_mail(
+            receiver=receiver,
+            subject="Package %s is out-of-date" % pac.name,
+            text="Local: %s\nRemote: %s" %
+                 (pac.local_version, pac.remote_version))
+
         self.record[pac.name] = objhash
         return True
 
+    def send_digests(self):
+        while self.digests:
+            receiver, pacs = self.digests.popitem(last=False)
+            text = "\n".join("%s\tLocal: %s\tRemote: %s" %
+                             (pac.name, pac.local_version, pac.remote_version)
+                             for pac in pacs)
+            if len(pacs) == 1:
+                subject = "Package %s is out-of-date" % pacs[0].name
+            else:
+                subject = "%d packages are out-of-date" % len(pacs)
+
+            try:
+                self.send_raw_mail(receiver=receiver, subject=subject,
+                                   text=text)
+            except Exception as exp:
+                logger.error("Failed to send Email to %r (%s)", receiver, exp)
+                continue
+
+            for pac in pacs:
+                self.record[pac.name] = pac.digest
+
     def finish(self):
+        try:
+            self.send_digests()
+        finally:
+            self.disconnect()
         return self.record
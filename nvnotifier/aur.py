@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import datetime
+
+logger = logging.getLogger(__name__)
+AUR_RPC = "https://aur.archlinux.org/rpc/"
+
+
+def _getboolean(conf, key):
+    return str(conf.get(key, "")).lower() in ("1", "yes", "true", "on")
+
+
+class AURBatcher:
+    """
+    Resolve versions of aur-sourced packages with multi-package
+    AUR RPC info requests instead of one request per package
+    """
+    # options of nvchecker's aur source that we understand
+    options = ("aur", "oldver", "use_last_modified", "strip-release")
+
+    def __init__(self, rpc_url=AUR_RPC, batch_size=100, scheduler=None,
+                 window=0.1, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.rpc_url = rpc_url
+        self.batch_size = batch_size
+        self.scheduler = scheduler
+        self.window = window
+        self.pending = {}
+        self.flush_handle = None
+
+    @classmethod
+    def from_meta(cls, meta, **kwargs):
+        return cls(rpc_url=meta.get("aur_rpc", AUR_RPC),
+                   batch_size=int(meta.get("aur_batch_size", 100)), **kwargs)
+
+    def accepts(self, nvconfig):
+        return all(k in self.options for k in nvconfig)
+
+    def get(self, aurname):
+        """future of the RPC info record of aurname (None if not found)"""
+        if aurname in self.pending:
+            return self.pending[aurname]
+
+        future = asyncio.Future()
+        self.pending[aurname] = future
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(self.window, self.flush)
+
+        return future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        while self.pending:
+            names = sorted(self.pending)[:self.batch_size]
+            batch = dict((n, self.pending.pop(n)) for n in names)
+            asyncio.ensure_future(self._query(batch))
+
+    def _request(self, names):
+        # imported here, runs without AUR checks don't need it
+        import requests
+
+        params = {"v": 5, "type": "info", "arg[]": names}
+        req = requests.get(self.rpc_url, params=params, timeout=60)
+        req.raise_for_status()
+        return req.json()
+
+    @asyncio.coroutine
+    def _query(self, batch):
+        try:
+            if self.scheduler:
+                with (yield from self.scheduler.slot("aur")):
+                    data = yield from self.loop.run_in_executor(
+                        None, self._request, list(batch))
+            else:
+                data = yield from self.loop.run_in_executor(
+                    None, self._request, list(batch))
+            results = dict((r["Name"], r) for r in data["results"])
+        except Exception as exp:
+            logger.error("AUR RPC request failed (%s)", exp)
+            results = {}
+
+        logger.debug("AUR RPC: %d of %d packages found",
+                     len(results), len(batch))
+        for name, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(name))
+
+    @asyncio.coroutine
+    def update(self, pac):
+        nvconfig = pac.nvconfig
+        aurname = nvconfig.get("aur") or pac.name
+        record = yield from self.get(aurname)
+
+        if record is None:
+            logger.debug("AUR upstream of %s not found", pac.name)
+            return pac.set_remote_version(None)
+
+        version = record["Version"]
+        if _getboolean(nvconfig, "use_last_modified"):
+            mtime = datetime.datetime.utcfromtimestamp(record["LastModified"])
+            version += "-" + mtime.strftime("%Y%m%d%H%M%S")
+        if _getboolean(nvconfig, "strip-release") and "-" in version:
+            version = version.rsplit("-", 1)[0]
+
+        return pac.set_remote_version(version)
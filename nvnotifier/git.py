@@ -3,17 +3,105 @@ import fnmatch
 import os
 import datetime
 
+from .metrics import METRICS
+
+# toplevel -> {"head": commit, "files": {relpath: (epoch, committer email)}}
+GIT_INDEX = {}
+
 
 def git_first_commit(repodir):
     cmd = ["git", "-C", repodir, "log", "--reverse", "-1", "--pretty=%h"]
+    METRICS.count_subprocess("git")
     output = subprocess.check_output(cmd)
     return output.decode("utf8").strip()
 
 
+def git_toplevel(repodir):
+    cmd = ["git", "-C", repodir, "rev-parse", "--show-toplevel"]
+    METRICS.count_subprocess("git")
+    output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+    return os.path.realpath(output.decode("utf8").strip())
+
+
+def git_head(repodir):
+    cmd = ["git", "-C", repodir, "rev-parse", "--verify", "HEAD"]
+    METRICS.count_subprocess("git")
+    output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+    return output.decode("utf8").strip()
+
+
+def git_is_ancestor(repodir, commit, head="HEAD"):
+    cmd = ["git", "-C", repodir, "merge-base", "--is-ancestor", commit, head]
+    METRICS.count_subprocess("git")
+    return subprocess.call(cmd, stderr=subprocess.DEVNULL) == 0
+
+
+def _git_walk(repodir, revision):
+    # one pass over history, newest commit first
+    cmd = ["git", "-C", repodir, "-c", "core.quotepath=off", "log",
+           "--name-only", "--format=%x01%ct %ce", revision]
+    METRICS.count_subprocess("git")
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+
+    files = {}
+    commit = None
+    for line in proc.stdout:
+        line = line.decode("utf8").rstrip("\n")
+        if line.startswith("\x01"):
+            epoch, _, email = line[1:].partition(" ")
+            commit = (int(epoch), email)
+        elif line and commit and line not in files:
+            files[line] = commit
+
+    if proc.wait() != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+    return files
+
+
+def git_build_index(repodir, saved=None):
+    """
+    Build path -> (last commit time, committer email) index of the git
+    repository containing repodir. If saved (an index returned by the
+    previous call) is still reachable from HEAD, only newer commits are
+    walked.
+    """
+    toplevel = git_toplevel(repodir)
+    head = git_head(toplevel)
+    saved_head = saved.get("head") if saved else None
+
+    if saved_head == head:
+        files = saved["files"]
+    elif saved_head and git_is_ancestor(toplevel, saved_head):
+        files = saved["files"].copy()
+        files.update(_git_walk(toplevel, "%s..%s" % (saved_head, head)))
+    else:
+        files = _git_walk(toplevel, head)
+
+    index = {"head": head, "files": files}
+    GIT_INDEX[toplevel] = index
+    return index
+
+
+def _git_index_lookup(path):
+    path = os.path.realpath(path)
+    for toplevel, index in GIT_INDEX.items():
+        if path.startswith(toplevel + os.sep):
+            relpath = os.path.relpath(path, toplevel)
+            return True, index["files"].get(relpath)
+
+    return False, None
+
+
 def git_latest_committer(path):
+    found, record = _git_index_lookup(path)
+    if found:
+        return record[1] if record else None
+
     cmd = ["git", "-C", os.path.dirname(path), "log", "-1",
            "--format=%ce", path]
     try:
+        METRICS.count_subprocess("git")
         output = subprocess.check_output(cmd)
     except subprocess.CalledProcessError:
         return None
@@ -22,10 +110,15 @@ def git_latest_committer(path):
 
 
 def git_last_change(path):
+    found, record = _git_index_lookup(path)
+    if found:
+        return datetime.datetime.fromtimestamp(record[0]) if record else None
+
     cmd = ["git", "-C", os.path.dirname(path), "log", "-1",
            "--format=%cd", "--date=raw", path]
 
     try:
+        METRICS.count_subprocess("git")
         output = subprocess.check_output(cmd)
         epoch = int(output.split()[0])
     except (subprocess.CalledProcessError, IndexError, ValueError):
@@ -34,27 +127,50 @@ def git_last_change(path):
         return datetime.datetime.fromtimestamp(epoch)
 
 
-def git_diff_from_head(repodir, commit, filter=None):
-    cmd = ["git", "-C", repodir, "diff", "--name-status", commit]
+def git_is_clean(repodir):
+    cmd = ["git", "-C", repodir, "status", "--porcelain", "--", "."]
+    try:
+        METRICS.count_subprocess("git")
+        output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        return False
+    else:
+        return not output.strip()
+
+
+def git_diff_from_head(repodir, commit, filter="*"):
+    cmd = ["git", "-C", repodir, "-c", "core.quotepath=off", "diff",
+           "--name-status", "--relative", commit]
+    METRICS.count_subprocess("git")
     proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
 
     deleted = set()
     updated = set()
     new = set()
     for line in proc.stdout:
-        line = line.strip().decode("utf8")
-        status, path = line.split()
+        fields = line.decode("utf8").rstrip("\n").split("\t")
+        status, paths = fields[0], fields[1:]
+
+        # renames and copies list the source path first
+        if status[0] == "R":
+            old_path, path = paths
+            if fnmatch.fnmatch(old_path, filter):
+                deleted.add(old_path)
+        elif status[0] == "C":
+            path = paths[1]
+        else:
+            path = paths[0]
 
         if fnmatch.fnmatch(path, filter):
             if status == "D":
                 deleted.add(path)
-            elif status == "A":
+            elif status[0] in "ARC":
                 new.add(path)
             else:
                 updated.add(path)
 
     if proc.wait() != 0:
-        raise subprocess.CalledProcessError
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
 
     return {
         "D": deleted,
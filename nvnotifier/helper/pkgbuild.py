@@ -1,87 +1,71 @@
 import re
-import shlex
 import subprocess
 import os
-from collections import defaultdict
+import copy
+import uuid
+import pickle
+import atexit
+import hashlib
+import threading
+from collections import OrderedDict
 
-BASEDIR = os.path.dirname(os.path.abspath(__file__))
-
-
-def remove_comments(string):
-    # from: http://stackoverflow.com/a/18381470
-    pattern = r"(\".*?\"|\'.*?\')|(#[^\r\n]*$)"
-    regex = re.compile(pattern, re.MULTILINE | re.DOTALL)
-
-    def _replacer(match):
-        if match.group(2) is not None:
-            return ""
-        else:
-            return match.group(1)
+from . import shell
+from ..metrics import METRICS
 
-    return regex.sub(_replacer, string)
-
-
-def replace_shell_vars(string, d):
-    if isinstance(string, str):
-        s = re.sub(r"\$\{(\w+)[^{}]*\}", r'{\1}', string)
-        s = re.sub(r"\$(\w+)", r'{\1}', s)
-        dd = defaultdict(lambda: "", d)
-        try:
-            return s.format(**dd)
-        except ValueError:
-            return string
-    else:
-        return [replace_shell_vars(w, d) for w in string]
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+_ECHO_OPTION = re.compile(r"-[neE]+$")
 
+# bump when parsing changes, so PARSE_CACHE entries of older parsers are
+# dropped instead of being trusted forever
+PARSER_VERSION = 2
 
-def shell_safe_parser(path):
-    with open(sys.argv[1]) as fin:
-        s = fin.read()
 
-    s = remove_comments(s)
-    magic = re.compile(
-              "^(\w+)=(\((?:[^)]*|\n*)\)|(?:.*|\n)*)\n", re.M)
+def frame_vars(variables, strict=True):
+    """
+    the result as printed by pkgbuild_worker.sh. If echo could print a
+    word differently (option-like or glob words), raise NotConfident, or
+    drop the word if not strict.
+    """
+    def words(value):
+        elems = value if isinstance(value, list) else [value or ""]
+        ret = []
+        for w in (w for elem in elems for w in elem.split()):
+            if _ECHO_OPTION.match(w) or any(g in w for g in "*?["):
+                if strict:
+                    raise shell.NotConfident("%r is not printed as is" % w)
+                continue
+            ret.append(w)
+        return ret
 
     d = {}
-    for (key, value) in magic.findall(s):
-        key = key.strip()
-        value = " ".join(v.strip() for v in value.split('\n') if v.strip())
-
-        if value.startswith("(") and value.endswith(")"):
-            try:
-                split = shlex.split(value[1:-1])
-            except ValueError:
-                d[key] = replace_shell_vars(value, d)
-            else:
-                d[key] = []
-                for v in split:
-                    d[key].append(replace_shell_vars(v.strip(), d))
-        else:
-            try:
-                shlex.split(value)[0]
-            except (ValueError, IndexError):
-                pass
-            finally:
-                value = re.sub(r'^[\'"]|[\'"]$', '', value)
-                d[key] = replace_shell_vars(value, d)
-
+    for key in ("pkgname", "source"):
+        d[key] = words(variables.get(key))
+    for key in ("epoch", "pkgver", "pkgrel"):
+        value = variables.get(key)
+        if isinstance(value, list):
+            value = value[0] if value else None
+        value = " ".join(words(value))
+        if value:
+            d[key] = value
     return d
 
 
-def shell_nosafe_parser(path):
-    script = os.path.join(BASEDIR, "pkgbuild_reader.sh")
-    p = subprocess.Popen(["bash", script, path],
-                         stdout=subprocess.PIPE,
-                         universal_newlines=True)
-    if p.wait() != 0:
-        return {}
+def shell_safe_parser(content):
+    """(d, confident), parse PKGBUILD content without running bash"""
+    variables, confident = shell.parse(content)
+    try:
+        return frame_vars(variables), confident
+    except shell.NotConfident:
+        return frame_vars(variables, strict=False), False
 
+
+def parse_framed_output(lines):
     last_is_blank = True
     d = {}
     key = None
     array = False
 
-    for line in p.stdout:
+    for line in lines:
         line = line.strip()
         if line == "":
             last_is_blank = True
@@ -101,16 +85,169 @@ def shell_nosafe_parser(path):
     return d
 
 
-def pkgbuild_parser(path, safe=False):
+class BashWorker:
+    """A restricted bash coprocess evaluating PKGBUILDs sent over a pipe"""
+    script = os.path.join(BASEDIR, "pkgbuild_worker.sh")
+
+    def __init__(self):
+        METRICS.count_subprocess("bash_worker")
+        self.proc = subprocess.Popen(
+            ["/bin/bash", "--norc", "--noprofile", "-r", self.script],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, env={"PATH": ""}, cwd="/")
+
+    @property
+    def alive(self):
+        return self.proc.poll() is None
+
+    def evaluate(self, content):
+        METRICS.count_subprocess("bash_eval")
+        nonce = uuid.uuid4().hex
+        data = "%s\0%s\0" % (nonce, content.replace("\0", ""))
+        self.proc.stdin.write(data.encode("utf8"))
+        self.proc.stdin.flush()
+
+        lines = None
+        for line in self.proc.stdout:
+            line = line.decode("utf8", "replace").rstrip("\n")
+            if line == nonce + "B":
+                lines = []
+            elif line == nonce + "E":
+                return parse_framed_output(lines) if lines is not None else {}
+            elif lines is not None:
+                lines.append(line)
+
+        raise EOFError("bash worker exited unexpectedly")
+
+    def close(self):
+        if self.alive:
+            self.proc.stdin.close()
+            self.proc.wait()
+
+
+class BashWorkerPool:
+    def __init__(self, size=None):
+        self.size = size or os.cpu_count() or 1
+        self.slots = threading.BoundedSemaphore(self.size)
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def evaluate(self, content):
+        with self.slots:
+            with self.lock:
+                worker = self.idle.pop() if self.idle else None
+
+            try:
+                worker = worker or BashWorker()
+                return worker.evaluate(content)
+            except (EOFError, OSError):
+                return {}
+            finally:
+                if worker and worker.alive:
+                    with self.lock:
+                        self.idle.append(worker)
+
+    def close(self):
+        with self.lock:
+            for worker in self.idle:
+                worker.close()
+            self.idle = []
+
+
+WORKER_POOL = BashWorkerPool()
+atexit.register(lambda: WORKER_POOL.close())
+
+
+def set_worker_pool_size(size):
+    global WORKER_POOL
+    WORKER_POOL.close()
+    WORKER_POOL = BashWorkerPool(size)
+
+
+def shell_nosafe_parser(content):
+    return WORKER_POOL.evaluate(content)
+
+
+class ParseCache:
+    """LRU cache of parsed PKGBUILDs keyed by hash of the file content"""
+
+    def __init__(self, path=None, max_size=20000):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+        self.dirty = False
+
+        if path:
+            try:
+                with open(path, "rb") as fin:
+                    version, data = pickle.load(fin)
+                if version == PARSER_VERSION:
+                    self.data = data
+            except (OSError, EOFError, ValueError, TypeError,
+                    pickle.UnpicklingError):
+                pass
+
+    def get(self, key):
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+            except KeyError:
+                return None
+            return copy.deepcopy(self.data[key])
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = copy.deepcopy(value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+            self.dirty = True
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+
+        with self.lock:
+            data = pickle.dumps((PARSER_VERSION, self.data))
+            self.dirty = False
+
+        tmpname = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmpname, "wb") as fout:
+            fout.write(data)
+        os.rename(tmpname, self.path)
+
+
+PARSE_CACHE = ParseCache()
+
+
+def load_parse_cache(path, max_size=20000):
+    global PARSE_CACHE
+    PARSE_CACHE = ParseCache(path, max_size)
+    return PARSE_CACHE
+
+
+def cache_key(data, safe=False):
+    return (hashlib.sha1(data).hexdigest(), safe)
+
+
+def parse_pkgbuild_data(data, safe=False):
+    """
+    parse raw PKGBUILD content, skipping PARSE_CACHE. Takes and returns
+    plain data, so it can run in a worker process. {} if it failed.
+    """
     accept_list = ["pkgbase", "pkgname", "source"]
     accept_str = ["epoch", "pkgver", "pkgrel", "source"]
+    content = data.decode("utf8", "replace")
 
-    if safe:
-        d = shell_safe_parser(path)
-    else:
-        d = shell_nosafe_parser(path)
+    # bash is only needed when the file is beyond shell_safe_parser
+    d, confident = shell_safe_parser(content)
+    if not confident and not safe:
+        d = shell_nosafe_parser(content)
         if not d:
-            d = shell_safe_parser(path)
+            # bash failed, what the Python parser got may be wrong and
+            # must not end up in PARSE_CACHE
+            return {}
 
     ret = {}
     for key in d:
@@ -127,7 +264,62 @@ def pkgbuild_parser(path, safe=False):
     return ret
 
 
+def pkgbuild_parser(path, safe=False):
+    with open(path, "rb") as fin:
+        data = fin.read()
+
+    key = cache_key(data, safe)
+    ret = PARSE_CACHE.get(key)
+    if ret is None:
+        ret = parse_pkgbuild_data(data, safe)
+        if ret:
+            PARSE_CACHE.put(key, ret)
+
+    return ret
+
+
+def bench(paths, rounds=20):
+    """
+    time the Python parser against the bash worker on the files the
+    Python parser is confident about, and count where they differ
+    """
+    import time
+
+    contents = []
+    for path in paths:
+        with open(path, "rb") as fin:
+            contents.append(fin.read().decode("utf8", "replace"))
+    confident = [c for c in contents if shell_safe_parser(c)[1]]
+    print("%d/%d parsed without bash" % (len(confident), len(contents)))
+    if not confident:
+        return
+
+    differ = sum(shell_safe_parser(c)[0] != shell_nosafe_parser(c)
+                 for c in confident)
+    print("%d differ from bash" % differ)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for c in confident:
+            shell_safe_parser(c)
+    python = (time.perf_counter() - start) / rounds / len(confident)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for c in confident:
+            shell_nosafe_parser(c)
+    bash = (time.perf_counter() - start) / rounds / len(confident)
+
+    print("python %.0f us/file, bash worker %.0f us/file" %
+          (python * 1e6, bash * 1e6))
+
+
 if __name__ == "__main__":
+    # python -m nvnotifier.helper.pkgbuild [--bench] PKGBUILD...
     import sys
-    d = pkgbuild_parser(sys.argv[1])
-    print(d)
+    paths = [arg for arg in sys.argv[1:] if arg != "--bench"]
+    if "--bench" in sys.argv:
+        bench(paths)
+    else:
+        for path in paths:
+            print(path, pkgbuild_parser(path))
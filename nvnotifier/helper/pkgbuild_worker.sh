@@ -0,0 +1,45 @@
+# Long-lived PKGBUILD reader, run by restricted bash (bash -r).
+# Reads "<nonce>\0<PKGBUILD content>\0" from stdin, evaluates the content
+# in a fresh subshell and prints the result framed by nonce markers.
+
+while IFS= read -r -d '' nonce && IFS= read -r -d '' pkgbuild
+do
+    # the markers are printed out of reach of the PKGBUILD
+    echo
+    echo "${nonce}B"
+    echo
+    (
+      # no output of the PKGBUILD itself gets into the frame
+      eval "$pkgbuild" >&-
+
+      # defined after eval, so the PKGBUILD can't replace it
+      function print_array () {
+          local elem
+          for elem in "$@"
+          do
+            echo ${elem}
+          done
+      }
+
+      echo [pkgname]
+      print_array ${pkgname[@]}
+      echo
+
+      echo \<epoch\>
+      echo ${epoch}
+      echo
+
+      echo \<pkgver\>
+      echo ${pkgver}
+      echo
+
+      echo \<pkgrel\>
+      echo ${pkgrel}
+      echo
+
+      echo [source]
+      print_array ${source[@]}
+      echo
+    ) < /dev/null
+    echo "${nonce}E"
+done
@@ -0,0 +1,685 @@
+"""
+Evaluate the static part of a PKGBUILD without running bash.
+
+Only a subset of bash is understood: variable and array assignments,
+quoting, $var / ${var} expansion with simple parameter substitution and
+function definitions (which are skipped, not run). Anything else, or
+anything whose result would depend on the environment (command
+substitution, globbing, brace expansion, ...) raises NotConfident, the
+caller should let bash evaluate the file then.
+"""
+
+import re
+
+# variables set by bash itself or by pkgbuild_worker.sh
+SHELL_VARS = frozenset((
+    "_", "nonce", "pkgbuild", "DIRSTACK", "EPOCHREALTIME", "EPOCHSECONDS",
+    "EUID", "FUNCNAME", "GROUPS", "HISTCMD", "HOSTNAME", "HOSTTYPE", "IFS",
+    "LINENO", "MACHTYPE", "OPTARG", "OPTERR", "OPTIND", "OSTYPE", "PATH",
+    "PIPESTATUS", "PPID", "PS4", "PWD", "RANDOM", "SECONDS", "SHELLOPTS",
+    "SHLVL", "SRANDOM", "UID"))
+
+_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_ASSIGN = re.compile(r"([A-Za-z_][A-Za-z0-9_]*)(\+?=)")
+_FUNCTION_NAME = r"[^\s=()<>|&;$\"'`\\]+"
+_FUNCTION = re.compile(r"(?:function\s+)?%s\s*\(\s*\)|function\s+%s" %
+                       (_FUNCTION_NAME, _FUNCTION_NAME))
+_INDEX = re.compile(r"\[(@|\*|[0-9]+)\]")
+_INT = re.compile(r"\s*([0-9]+)\s*$")
+
+# characters ending an unquoted word
+_METACHARS = " \t\n;&|<>()"
+# characters that make bash glob or brace expand an unquoted word
+_GLOBCHARS = "*?["
+
+
+class NotConfident(Exception):
+    pass
+
+
+def glob_to_regex(pieces):
+    """regex of a bash pattern given as (text, active) pieces"""
+    merged = []
+    for text, active in pieces:
+        if merged and merged[-1][1] == active:
+            merged[-1] = (merged[-1][0] + text, active)
+        else:
+            merged.append((text, active))
+
+    regex = []
+    for text, active in merged:
+        if not active:
+            regex.append(re.escape(text))
+            continue
+
+        i = 0
+        while i < len(text):
+            c = text[i]
+            if c == "*":
+                regex.append(".*")
+            elif c == "?":
+                regex.append(".")
+            elif c == "[":
+                j = i + 1
+                if j < len(text) and text[j] in "!^":
+                    j += 1
+                if j < len(text) and text[j] == "]":
+                    j += 1
+                j = text.find("]", j)
+                if j < 0:
+                    regex.append(re.escape(c))
+                else:
+                    inner = text[i+1:j]
+                    if inner[:1] in ("!", "^"):
+                        inner = "^" + inner[1:]
+                    if "[:" in inner:
+                        raise NotConfident("character class in pattern")
+                    regex.append("[%s]" % inner.replace("\\", "\\\\"))
+                    i = j
+            else:
+                regex.append(re.escape(c))
+            i += 1
+
+    return re.compile("".join(regex), re.S)
+
+
+def remove_prefix(s, regex, longest):
+    indices = range(len(s), -1, -1) if longest else range(len(s) + 1)
+    for i in indices:
+        if regex.fullmatch(s, 0, i):
+            return s[i:]
+    return s
+
+
+def remove_suffix(s, regex, longest):
+    indices = range(len(s) + 1) if longest else range(len(s), -1, -1)
+    for i in indices:
+        if regex.fullmatch(s, i):
+            return s[:i]
+    return s
+
+
+def substitute(s, regex, rep, every):
+    if not s:
+        return rep if regex.fullmatch(s) else s
+
+    out = []
+    i = 0
+    while i <= len(s):
+        for j in range(len(s), i - 1, -1):
+            if j > i and regex.fullmatch(s, i, j):
+                out.append(rep)
+                i = j
+                break
+        else:
+            if i < len(s):
+                out.append(s[i])
+            i += 1
+            continue
+
+        if not every:
+            out.append(s[i:])
+            break
+
+    return "".join(out)
+
+
+class ShellParser:
+    def __init__(self, content):
+        self.s = content
+        self.i = 0
+        self.vars = {}
+
+    def error(self, msg):
+        raise NotConfident("%s at offset %d" % (msg, self.i))
+
+    def peek(self, n=1):
+        return self.s[self.i:self.i+n]
+
+    def parse(self):
+        """variables assigned at top level, raise NotConfident"""
+        while True:
+            self.skip_blank(newline=True, semicolon=True)
+            if self.i >= len(self.s):
+                return self.vars
+
+            if not self.function() and not self.assignments():
+                self.error("unsupported command")
+
+    def skip_blank(self, newline=False, semicolon=False):
+        s = self.s
+        while self.i < len(s):
+            c = s[self.i]
+            if c in " \t" or (newline and c == "\n") or \
+               (semicolon and c == ";"):
+                self.i += 1
+            elif c == "\\" and s[self.i+1:self.i+2] == "\n":
+                self.i += 2
+            elif c == "#" and newline:
+                end = s.find("\n", self.i)
+                self.i = len(s) if end < 0 else end
+            else:
+                break
+
+    # top level statements
+
+    def assignments(self):
+        m = _ASSIGN.match(self.s, self.i)
+        if not m:
+            return False
+
+        while m:
+            name, op = m.groups()
+            if name in SHELL_VARS or name.startswith("BASH"):
+                self.error("assignment to shell variable")
+            self.i = m.end()
+
+            if self.peek() == "(":
+                self.i += 1
+                value = self.array()
+            else:
+                value = self.word(split=False)
+
+            old = self.vars.get(name)
+            if op == "+=" and old is not None:
+                if isinstance(old, list) or isinstance(value, list):
+                    old = old if isinstance(old, list) else [old]
+                    value = old + value if isinstance(value, list) \
+                        else [old[0] + value if old else value] + old[1:]
+                else:
+                    value = old + value
+            elif isinstance(old, list) and not isinstance(value, list):
+                # `array=value` sets the first element only
+                value = [value] + old[1:]
+            self.vars[name] = value
+
+            self.skip_blank()
+            c = self.peek()
+            if c in ("", "\n", ";", "#"):
+                return True
+            m = _ASSIGN.match(self.s, self.i)
+
+        # `FOO=bar command`
+        self.error("command after assignment")
+
+    def function(self):
+        m = _FUNCTION.match(self.s, self.i)
+        if not m:
+            return False
+
+        self.i = m.end()
+        self.skip_blank(newline=True)
+        if self.peek() != "{":
+            self.error("function body is not a group command")
+        self.i += 1
+        self.skip_body()
+        return True
+
+    def skip_body(self):
+        """skip to the end of a function body, without evaluating it"""
+        s = self.s
+        depth = 1
+        heredocs = []
+        # kind of the last token: "\n", "{", an operator or "w" (a word)
+        last = "\n"
+        prev_word = ""
+
+        while self.i < len(s):
+            c = s[self.i]
+            if c in " \t":
+                self.i += 1
+                continue
+
+            command_start = last in "\n;&|{(" or \
+                prev_word in ("then", "do", "else")
+            word_start = self.i == 0 or s[self.i-1] in " \t\n;&|(){}"
+            start = self.i
+
+            last = "w"
+            if c == "\n":
+                last = "\n"
+                self.i += 1
+                for delimiter, strip_tabs in heredocs:
+                    self.skip_heredoc(delimiter, strip_tabs)
+                heredocs = []
+            elif c == "#" and word_start:
+                end = s.find("\n", self.i)
+                self.i = len(s) if end < 0 else end
+                continue
+            elif c == "{" and command_start and \
+                    s[self.i+1:self.i+2] in (" ", "\t", "\n"):
+                depth += 1
+                last = "{"
+                self.i += 1
+            elif c == "}" and command_start and \
+                    s[self.i+1:self.i+2] in ("", " ", "\t", "\n", ";",
+                                             ")", "&", "|", "}"):
+                depth -= 1
+                self.i += 1
+                if depth == 0:
+                    return
+            elif s.startswith("<<<", self.i):
+                self.i += 3
+            elif s.startswith("<<", self.i):
+                self.i += 2
+                heredocs.append(self.heredoc_delimiter())
+            elif c in "\\'\"`$":
+                self.skip_quoted()
+            elif c in ";&|(":
+                last = c
+                self.i += 1
+            else:
+                self.i += 1
+                while self.i < len(s) and s[self.i] not in \
+                        " \t\n;&|(){}<>\\'\"`$":
+                    self.i += 1
+
+            prev_word = s[start:self.i]
+
+        self.error("unterminated function body")
+
+    def heredoc_delimiter(self):
+        strip_tabs = self.peek() == "-"
+        if strip_tabs:
+            self.i += 1
+        self.skip_blank()
+
+        start = self.i
+        while self.i < len(self.s) and self.s[self.i] not in _METACHARS:
+            if self.s[self.i] in "\\'\"":
+                self.skip_quoted()
+            else:
+                self.i += 1
+
+        delimiter = re.sub(r"[\\'\"]", "", self.s[start:self.i])
+        if not delimiter or "$" in delimiter or "`" in delimiter:
+            self.error("unsupported here-document delimiter")
+        return delimiter, strip_tabs
+
+    def skip_heredoc(self, delimiter, strip_tabs):
+        while self.i < len(self.s):
+            end = self.s.find("\n", self.i)
+            end = len(self.s) if end < 0 else end
+            line = self.s[self.i:end]
+            self.i = min(end + 1, len(self.s))
+            if (line.lstrip("\t") if strip_tabs else line) == delimiter:
+                return
+        self.error("unterminated here-document")
+
+    def skip_quoted(self):
+        """skip one quoted string, escape or $-expansion in a function"""
+        s = self.s
+        c = s[self.i]
+        if c == "\\":
+            self.i += 2
+        elif c == "'":
+            end = s.find("'", self.i + 1)
+            if end < 0:
+                self.error("unterminated quote")
+            self.i = end + 1
+        elif c == "`":
+            self.i += 1
+            while self.peek() != "`":
+                if self.i >= len(s):
+                    self.error("unterminated backquote")
+                self.i += 2 if self.peek() == "\\" else 1
+            self.i += 1
+        elif c == '"':
+            self.i += 1
+            while self.peek() != '"':
+                if self.i >= len(s):
+                    self.error("unterminated quote")
+                if self.peek() in "\\$`":
+                    self.skip_quoted()
+                else:
+                    self.i += 1
+            self.i += 1
+        elif s.startswith("$'", self.i):
+            self.i += 2
+            while self.peek() != "'":
+                if self.i >= len(s):
+                    self.error("unterminated quote")
+                self.i += 2 if self.peek() == "\\" else 1
+            self.i += 1
+        elif s.startswith("$(", self.i) or s.startswith("${", self.i):
+            opening, closing = s[self.i+1], ")" if s[self.i+1] == "(" else "}"
+            self.i += 2
+            depth = 1
+            while depth:
+                if self.i >= len(s):
+                    self.error("unterminated expansion")
+                c = s[self.i]
+                if c in "\\'\"`$" and (c != "$" or
+                                      s[self.i+1:self.i+2] in "({'"):
+                    self.skip_quoted()
+                    continue
+                elif c == opening:
+                    depth += 1
+                elif c == closing:
+                    depth -= 1
+                self.i += 1
+        else:
+            self.i += 1
+
+    # words
+
+    def array(self):
+        values = []
+        while True:
+            self.skip_blank(newline=True)
+            c = self.peek()
+            if c == ")":
+                self.i += 1
+                return values
+            elif c == "" or c in _METACHARS:
+                self.error("unexpected %r in array" % c)
+            values.extend(self.word(split=True))
+
+    def word(self, split):
+        """
+        value of an unquoted word, a str if split is False, otherwise a
+        list of fields after word splitting (as in an array assignment)
+        """
+        pieces = []
+        s = self.s
+        while self.i < len(s):
+            c = s[self.i]
+            if c in _METACHARS:
+                break
+            elif c == "\\":
+                nxt = s[self.i+1:self.i+2]
+                if nxt == "":
+                    self.error("backslash at end of file")
+                self.i += 2
+                if nxt != "\n":
+                    pieces.append(("quoted", nxt))
+            elif c == "'":
+                end = s.find("'", self.i + 1)
+                if end < 0:
+                    self.error("unterminated quote")
+                pieces.append(("quoted", s[self.i+1:end]))
+                self.i = end + 1
+            elif c == '"':
+                self.i += 1
+                pieces.extend(self.dquote())
+            elif c == "$":
+                pieces.append(self.dollar(quoted=False))
+            elif c == "`":
+                self.error("command substitution")
+            else:
+                start = self.i
+                while self.i < len(s) and s[self.i] not in \
+                        _METACHARS + "\\'\"$`":
+                    self.i += 1
+                text = s[start:self.i]
+                if "~" in text:
+                    self.error("tilde expansion")
+                if split and any(g in text for g in _GLOBCHARS + "{"):
+                    self.error("glob or brace expansion")
+                pieces.append(("quoted", text))
+
+        if not split:
+            return "".join(" ".join(v) if isinstance(v, list) else v
+                           for kind, v in pieces)
+        return self.fields(pieces)
+
+    def fields(self, pieces):
+        fields = []
+        current = None
+        for kind, value in pieces:
+            if kind == "quoted" or \
+               (kind == "expanded" and not isinstance(value, list)):
+                current = (current or "") + value
+                continue
+
+            if kind == "expanded" and isinstance(value, list):
+                # "${array[@]}"
+                if value:
+                    current = (current or "") + value[0]
+                    for elem in value[1:]:
+                        fields.append(current)
+                        current = elem
+                continue
+
+            if isinstance(value, list):
+                value = " ".join(value)
+            if any(g in value for g in _GLOBCHARS):
+                self.error("glob characters in unquoted expansion")
+            words = value.split()
+            if value[:1].isspace() and current is not None:
+                fields.append(current)
+                current = None
+            for i, w in enumerate(words):
+                current = (current or "") + w
+                if i < len(words) - 1:
+                    fields.append(current)
+                    current = None
+            if words and value[-1:].isspace():
+                fields.append(current)
+                current = None
+
+        if current is not None:
+            fields.append(current)
+        return fields
+
+    def dquote(self):
+        """pieces of a double quoted string, after the opening quote"""
+        pieces = []
+        s = self.s
+        while True:
+            if self.i >= len(s):
+                self.error("unterminated quote")
+            c = s[self.i]
+            if c == '"':
+                self.i += 1
+                return pieces
+            elif c == "\\":
+                nxt = s[self.i+1:self.i+2]
+                self.i += 2
+                if nxt in ("$", "`", '"', "\\"):
+                    pieces.append(("quoted", nxt))
+                elif nxt != "\n":
+                    pieces.append(("quoted", "\\" + nxt))
+            elif c == "$":
+                pieces.append(self.dollar(quoted=True))
+            elif c == "`":
+                self.error("command substitution")
+            else:
+                start = self.i
+                while self.i < len(s) and s[self.i] not in '"\\$`':
+                    self.i += 1
+                pieces.append(("quoted", s[start:self.i]))
+
+    def lookup(self, name):
+        if name in self.vars:
+            return self.vars[name]
+        if name in SHELL_VARS or name.startswith("BASH"):
+            self.error("shell variable $%s" % name)
+        return None
+
+    def scalar(self, name):
+        value = self.lookup(name)
+        if isinstance(value, list):
+            return value[0] if value else ""
+        return value or ""
+
+    def dollar(self, quoted):
+        """(kind, value) of an expansion starting with $"""
+        s = self.s
+        nxt = s[self.i+1:self.i+2]
+        kind = "expanded" if quoted else "split"
+
+        if nxt == "{":
+            self.i += 2
+            return kind, self.braced(quoted)
+
+        m = _NAME.match(s, self.i + 1)
+        if m:
+            self.i = m.end()
+            return kind, self.scalar(m.group())
+
+        if quoted and (nxt == "" or nxt in ' \t\n;&|<>)/:.,=+%"'):
+            # a lonely $. Unquoted, $"..." is a locale string, and bash
+            # doesn't split a word with a lonely $ after an expansion
+            self.i += 1
+            return "quoted", "$"
+
+        self.error("unsupported expansion $%s" % nxt)
+
+    def braced(self, quoted):
+        """value of ${...}, after the opening brace"""
+        s = self.s
+        length = s[self.i:self.i+1] == "#" and \
+            s[self.i+1:self.i+2] not in ("}", "")
+        if length:
+            self.i += 1
+
+        m = _NAME.match(s, self.i)
+        if not m:
+            self.error("unsupported parameter")
+        name = m.group()
+        self.i = m.end()
+
+        value = self.lookup(name)
+        index = None
+        m = _INDEX.match(s, self.i)
+        if m:
+            index = m.group(1)
+            self.i = m.end()
+            elems = value if isinstance(value, list) else \
+                ([value] if value is not None else [])
+            if index in ("@", "*"):
+                if self.peek() != "}":
+                    self.error("operator on whole array")
+                self.i += 1
+                if length:
+                    return str(len(elems))
+                return elems if index == "@" else " ".join(elems)
+            value = elems[int(index)] if int(index) < len(elems) else None
+        elif isinstance(value, list):
+            value = value[0] if value else None
+
+        if length:
+            if self.peek() != "}":
+                self.error("unsupported ${#...}")
+            self.i += 1
+            return str(len(value or ""))
+
+        op = None
+        for candidate in (":-", ":+", "##", "%%", "//", "^^", ",,",
+                          "-", "+", "#", "%", "/", "^", ",", ":", "}"):
+            if s.startswith(candidate, self.i):
+                op = candidate
+                break
+        if op is None:
+            self.error("unsupported parameter operator")
+        self.i += len(op)
+
+        if op == "}":
+            return value or ""
+
+        if op in (":-", "-", ":+", "+"):
+            operand = self.operand(quoted, pattern=False)
+            unset = value is None or (op[0] == ":" and value == "")
+            if op.endswith("-"):
+                return operand if unset else value
+            return "" if unset else operand
+
+        unset = value is None
+        value = value or ""
+        if op in ("^^", ",,", "^", ","):
+            if self.peek() != "}":
+                self.error("case modification with pattern")
+            self.i += 1
+            if op == "^^":
+                return value.upper()
+            elif op == ",,":
+                return value.lower()
+            elif op == "^":
+                return value[:1].upper() + value[1:]
+            return value[:1].lower() + value[1:]
+
+        if op == ":":
+            operand = self.operand(quoted, pattern=False)
+            parts = operand.split(":")
+            m = [_INT.match(p) for p in parts]
+            if len(parts) > 2 or not all(m):
+                self.error("unsupported substring expansion")
+            offset = int(m[0].group(1))
+            if len(parts) == 1:
+                return value[offset:]
+            return value[offset:offset+int(m[1].group(1))]
+
+        if op in ("/", "//"):
+            if self.peek() in ("#", "%"):
+                self.error("anchored substitution")
+            pattern = self.operand(quoted, pattern=True, stop="/")
+            rep = ""
+            if s[self.i-1] == "/":
+                rep = self.operand(quoted, pattern=False)
+            if unset or not "".join(text for text, active in pattern):
+                return value
+            return substitute(value, glob_to_regex(pattern), rep, op == "//")
+
+        regex = glob_to_regex(self.operand(quoted, pattern=True))
+        if op in ("#", "##"):
+            return remove_prefix(value, regex, op == "##")
+        return remove_suffix(value, regex, op == "%%")
+
+    def operand(self, quoted, pattern, stop=""):
+        """
+        word inside ${...} up to the closing brace (or stop), consumed.
+        A pattern is returned as (text, active) pieces.
+        """
+        s = self.s
+        pieces = []
+        while True:
+            if self.i >= len(s):
+                self.error("unterminated ${")
+            c = s[self.i]
+            if c == "}" or c in stop:
+                self.i += 1
+                break
+            elif c == "\\":
+                pieces.append((s[self.i+1:self.i+2], False))
+                self.i += 2
+            elif c == "'":
+                if quoted:
+                    self.error("single quote in quoted ${...}")
+                end = s.find("'", self.i + 1)
+                if end < 0:
+                    self.error("unterminated quote")
+                pieces.append((s[self.i+1:end], False))
+                self.i = end + 1
+            elif c == '"':
+                self.i += 1
+                for kind, value in self.dquote():
+                    if isinstance(value, list):
+                        value = " ".join(value)
+                    pieces.append((value, False))
+            elif c == "$":
+                kind, value = self.dollar(quoted)
+                if isinstance(value, list):
+                    value = " ".join(value)
+                pieces.append((value, pattern))
+            elif c in "`{":
+                self.error("unsupported character in ${...}")
+            else:
+                pieces.append((c, True))
+                self.i += 1
+
+        if pattern:
+            return pieces
+        if not quoted and any(not active for text, active in pieces):
+            # quoting inside an unquoted ${...} changes word splitting
+            self.error("quotes in unquoted ${...}")
+        return "".join(text for text, active in pieces)
+
+
+def parse(content):
+    """(variables, confident), variables is partial if not confident"""
+    parser = ShellParser(content)
+    try:
+        return parser.parse(), True
+    except NotConfident:
+        return parser.vars, False
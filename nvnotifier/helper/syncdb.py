@@ -1,31 +1,113 @@
-import tarfile
+import re
 import os
+import pickle
+import logging
+import tarfile
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# only these fields of desc files are read
+_FIELD = re.compile(rb"^%(NAME|VERSION|FILENAME)%\n([^\n]*)", re.M)
+
+SyncRecord = namedtuple("SyncRecord", ("name", "version", "filename"))
+
+
+def open_db(fileobj):
+    """tarfile reading a pacman sync db stream (gz, bz2, xz or zstd)"""
+    if fileobj.peek(4)[:4] == ZSTD_MAGIC:
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("python-zstandard is needed to read "
+                               "zstd compressed databases")
+        reader = zstandard.ZstdDecompressor().stream_reader(fileobj)
+        return tarfile.open(fileobj=reader, mode="r|")
+
+    return tarfile.open(fileobj=fileobj, mode="r|*")
+
+
+def read_db(filename):
+    """{name: (version, filename)} of a sync db, in one pass"""
+    records = {}
+    with open(filename, "rb") as fin, open_db(fin) as tar:
+        for mem in tar:
+            if not mem.isfile() or os.path.basename(mem.name) != "desc":
+                continue
+
+            fields = dict(_FIELD.findall(tar.extractfile(mem).read()))
+            if b"NAME" in fields:
+                records[fields[b"NAME"].decode("utf8")] = (
+                    fields.get(b"VERSION", b"").decode("utf8"),
+                    fields.get(b"FILENAME", b"").decode("utf8"))
+    return records
 
 
 class SyncDB:
-    def __init__(self, filename):
-        self.pkgs = {}
-
-        with tarfile.open(filename) as tar:
-            for mem in tar.getmembers():
-                if not mem.isfile() or \
-                   not os.path.basename(mem.name) == "desc":
-                    continue
-
-                d = {}
-                with tar.extractfile(mem) as fin:
-                    ready, key = True, ""
-                    for l in fin:
-                        l = l.decode("utf8")
-                        if l.strip() == "":
-                            ready = True
-                        elif ready and l.startswith("%"):
-                            key = l.strip("\n %")
-                            d[key] = []
-                            ready = False
-                        elif not ready:
-                            d[key].append(l[:-1])
-
-                if len(d.get("NAME", [])) == 1:
-                    self.pkgs[d["NAME"][0]] = dict((k, "\n".join(d[k]))
-                                                   for k in d)
+    """
+    Packages of a pacman sync db. The db is read on first lookup, or the
+    index in cache is used if the db has the same mtime and size.
+    """
+
+    def __init__(self, filename, cache=None):
+        self.filename = filename
+        self.cache = cache
+        self._records = None
+        self._loaded = None
+
+    @property
+    def records(self):
+        if self._records is None:
+            self._loaded = self._key()
+            self._records = self._load(self._loaded)
+        return self._records
+
+    def refresh(self):
+        """read the db again on next lookup if it changed on disk"""
+        if self._records is not None and self._key() != self._loaded:
+            self._records = None
+
+    def _key(self):
+        stat = os.stat(self.filename)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self, key):
+        if self.cache:
+            try:
+                with open(self.cache, "rb") as fin:
+                    saved_key, records = pickle.load(fin)
+                if saved_key == key:
+                    return records
+            except (OSError, EOFError, ValueError, pickle.PickleError):
+                pass
+
+        records = read_db(self.filename)
+        logger.debug("Read %d packages from %r", len(records), self.filename)
+
+        if self.cache:
+            tmpname = "%s.%d" % (self.cache, os.getpid())
+            with open(tmpname, "wb") as fout:
+                pickle.dump((key, records), fout, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, self.cache)
+
+        return records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __contains__(self, name):
+        return name in self.records
+
+    def __getitem__(self, name):
+        return SyncRecord(name, *self.records[name])
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
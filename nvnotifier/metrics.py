@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import datetime
+import threading
+from contextlib import contextmanager
+from collections import Counter, OrderedDict
+
+# upper bounds (seconds) of remote check latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class SourceStats:
+    """latency and results of remote checks of one nvchecker source"""
+
+    def __init__(self):
+        self.ok = 0
+        self.failed = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, seconds, ok):
+        if ok:
+            self.ok += 1
+        else:
+            self.failed += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+    @property
+    def count(self):
+        return self.ok + self.failed
+
+    def summary(self):
+        return OrderedDict((
+            ("ok", self.ok),
+            ("failed", self.failed),
+            ("seconds", round(self.seconds, 6)),
+            ("mean_seconds",
+             round(self.seconds / self.count, 6) if self.count else None),
+            ("max_seconds", round(self.max_seconds, 6)),
+        ))
+
+
+class Metrics:
+    """
+    Counters of this process: wall time of each phase per repository,
+    subprocesses spawned by kind, and remote check latency per source.
+    Values add up until reset, like Prometheus counters.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.phases = OrderedDict()
+            self.subprocesses = Counter()
+            self.remote = OrderedDict()
+
+    @contextmanager
+    def phase(self, repo, name):
+        """usage: with METRICS.phase(repo, "local"): ..."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self.lock:
+                seconds, runs = self.phases.get((repo, name), (0.0, 0))
+                self.phases[(repo, name)] = (seconds + elapsed, runs + 1)
+
+    def count_subprocess(self, kind, n=1):
+        with self.lock:
+            self.subprocesses[kind] += n
+
+    def observe_remote(self, source, seconds, ok):
+        with self.lock:
+            stats = self.remote.get(source or "unknown")
+            if stats is None:
+                stats = self.remote[source or "unknown"] = SourceStats()
+            stats.observe(seconds, ok)
+
+    def summary(self):
+        with self.lock:
+            phases = OrderedDict()
+            for (repo, name), (seconds, runs) in self.phases.items():
+                phases.setdefault(repo, OrderedDict())[name] = OrderedDict(
+                    (("seconds", round(seconds, 6)), ("runs", runs)))
+
+            return OrderedDict((
+                ("started", datetime.datetime.fromtimestamp(
+                    self.started).isoformat()),
+                ("elapsed", round(time.time() - self.started, 6)),
+                ("phases", phases),
+                ("subprocesses", OrderedDict(sorted(
+                    self.subprocesses.items()))),
+                ("remote", OrderedDict(
+                    (source, stats.summary())
+                    for source, stats in self.remote.items())),
+            ))
+
+    def prometheus(self):
+        """the metrics in Prometheus text exposition format"""
+        lines = []
+
+        def family(name, kind, doc):
+            lines.append("# HELP %s %s" % (name, doc))
+            lines.append("# TYPE %s %s" % (name, kind))
+
+        def sample(name, labels, value):
+            label_str = ",".join('%s="%s"' % (k, escape(v))
+                                 for k, v in labels)
+            lines.append("%s{%s} %s" % (name, label_str, value) if label_str
+                         else "%s %s" % (name, value))
+
+        with self.lock:
+            family("nvnotifier_last_run_timestamp_seconds", "gauge",
+                   "Time the metrics were written.")
+            sample("nvnotifier_last_run_timestamp_seconds", (), time.time())
+
+            family("nvnotifier_phase_seconds_total", "counter",
+                   "Wall time spent in each phase.")
+            for (repo, name), (seconds, runs) in self.phases.items():
+                sample("nvnotifier_phase_seconds_total",
+                       (("repo", repo), ("phase", name)), seconds)
+            family("nvnotifier_phase_runs_total", "counter",
+                   "Times each phase was run.")
+            for (repo, name), (seconds, runs) in self.phases.items():
+                sample("nvnotifier_phase_runs_total",
+                       (("repo", repo), ("phase", name)), runs)
+
+            family("nvnotifier_subprocesses_total", "counter",
+                   "Subprocesses spawned or used, by kind.")
+            for kind, n in sorted(self.subprocesses.items()):
+                sample("nvnotifier_subprocesses_total", (("kind", kind),), n)
+
+            family("nvnotifier_remote_checks_total", "counter",
+                   "Remote version checks by nvchecker source and result.")
+            for source, stats in self.remote.items():
+                for result, n in (("ok", stats.ok), ("failed", stats.failed)):
+                    sample("nvnotifier_remote_checks_total",
+                           (("source", source), ("result", result)), n)
+
+            family("nvnotifier_remote_check_seconds", "histogram",
+                   "Latency of remote version checks by nvchecker source.")
+            for source, stats in self.remote.items():
+                for bound, n in zip(LATENCY_BUCKETS, stats.buckets):
+                    sample("nvnotifier_remote_check_seconds_bucket",
+                           (("source", source), ("le", str(bound))), n)
+                sample("nvnotifier_remote_check_seconds_bucket",
+                       (("source", source), ("le", "+Inf")), stats.count)
+                sample("nvnotifier_remote_check_seconds_sum",
+                       (("source", source),), stats.seconds)
+                sample("nvnotifier_remote_check_seconds_count",
+                       (("source", source),), stats.count)
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path=None, prom_path=None):
+        if json_path:
+            _write_file(json_path, json.dumps(self.summary(), indent=2) + "\n")
+        if prom_path:
+            _write_file(prom_path, self.prometheus())
+
+
+def escape(value):
+    return str(value).replace("\\", r"\\").replace('"', r'\"') \
+        .replace("\n", r"\n")
+
+
+def _write_file(path, text):
+    # replace as a whole, node_exporter may read it any time
+    tmpname = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmpname, "w") as fout:
+        fout.write(text)
+    os.replace(tmpname, path)
+
+
+METRICS = Metrics()
@@ -1,47 +1,192 @@
-import re
 import os
 from functools import total_ordering
-from nvchecker.get_version import get_version
 from abc import ABCMeta, abstractmethod
-from tornado.platform.asyncio import AsyncIOMainLoop
-from tornado.stack_context import ExceptionStackContext
-from pkg_resources import parse_version
 from .helper.pkgbuild import pkgbuild_parser
 from .git import git_last_change
+from .vercmp import parse_evr, vercmp_key, vercmp_keys
+from .metrics import METRICS
 import datetime
 import asyncio
 import operator
 import logging
 import configparser
-
-
-# Tell Tornado to use the asyncio eventloop
-AsyncIOMainLoop().install()
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 TIMESTAMP = datetime.datetime.now()
 logger = logging.getLogger(__name__)
 
 
+# nvchecker sources that run commands in the current directory
+CWD_SOURCES = ("vcs", "cmd")
+REMOTE_WORKERS = None
+_remote_executor = None
+_nvchecker = None
+_worker_loop = None
+
+# pool reading local versions, "thread" or "process"
+LOCAL_EXECUTORS = ("thread", "process")
+LOCAL_EXECUTOR = "thread"
+LOCAL_WORKERS = None
+_local_executor = None
+
+
 def refresh_timestamp():
     global TIMESTAMP
     TIMESTAMP = datetime.datetime.now()
 
 
+def set_remote_workers(workers):
+    global REMOTE_WORKERS, _remote_executor
+    REMOTE_WORKERS = workers
+    if _remote_executor is not None:
+        _remote_executor.shutdown(wait=False)
+        _remote_executor = None
+
+
+def remote_executor():
+    global _remote_executor
+    if _remote_executor is None:
+        try:
+            _remote_executor = ProcessPoolExecutor(
+                REMOTE_WORKERS, initializer=init_remote_worker)
+        except TypeError:
+            # no initializer before Python 3.7, get_version_in does it
+            _remote_executor = ProcessPoolExecutor(REMOTE_WORKERS)
+    return _remote_executor
+
+
+def init_remote_worker():
+    """
+    Set up the event loop and IOLoop of a remote_executor() worker once,
+    they are reused by all its checks: the SIGCHLD handler of tornado's
+    Subprocess, used by the cmd and vcs sources, is bound to the first
+    IOLoop of the process.
+    """
+    global _worker_loop
+    if _worker_loop is None:
+        from tornado.ioloop import IOLoop
+        from tornado.platform.asyncio import AsyncIOMainLoop
+
+        _worker_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_worker_loop)
+        # a forked worker may have the IOLoop of the parent
+        IOLoop.clear_instance()
+        AsyncIOMainLoop().install()
+    return _worker_loop
+
+
+def set_local_executor(kind="thread", workers=None):
+    global LOCAL_EXECUTOR, LOCAL_WORKERS, _local_executor
+    if kind not in LOCAL_EXECUTORS:
+        raise ValueError("Unknown local executor %r" % kind)
+
+    LOCAL_EXECUTOR = kind
+    LOCAL_WORKERS = workers
+    if _local_executor is not None:
+        _local_executor.shutdown(wait=False)
+        _local_executor = None
+
+
+def local_executor():
+    global _local_executor
+    if _local_executor is None:
+        workers = LOCAL_WORKERS or os.cpu_count() or 1
+        if LOCAL_EXECUTOR == "process":
+            _local_executor = ProcessPoolExecutor(workers)
+        else:
+            _local_executor = ThreadPoolExecutor(workers)
+    return _local_executor
+
+
+def parse_version(s):
+    # pkg_resources is slow to import
+    from pkg_resources import parse_version
+    return parse_version(s)
+
+
+def load_nvchecker():
+    """
+    Import nvchecker and tornado on the first remote check, local only
+    runs don't pay for them
+    """
+    global _nvchecker
+    if _nvchecker is None:
+        from nvchecker.get_version import get_version
+        from tornado.platform.asyncio import AsyncIOMainLoop
+        from tornado.stack_context import ExceptionStackContext
+
+        # Tell Tornado to use the asyncio eventloop
+        AsyncIOMainLoop().install()
+        _nvchecker = (get_version, ExceptionStackContext)
+    return _nvchecker
+
+
+def nvchecker_config(nvconfig):
+    dmparser = configparser.RawConfigParser()
+    dmparser.read_dict({"_": nvconfig})
+    return dmparser["_"]
+
+
+def get_version_in(workdir, name, nvconfig):
+    """
+    Run nvchecker with workdir as current directory. This is run in a
+    worker process of remote_executor(), so chdir doesn't affect others.
+    """
+    from nvchecker.get_version import get_version
+    from tornado.stack_context import ExceptionStackContext
+
+    os.chdir(workdir)
+    loop = init_remote_worker()
+    future = asyncio.Future(loop=loop)
+
+    def handle_exception(type, value, traceback):
+        logger.error("nvchecker failed to get version of %s (%s)",
+                     name, value)
+        if not future.done():
+            future.set_result(None)
+        return True
+
+    def cb(name, newver):
+        if not future.done():
+            future.set_result(newver)
+
+    with ExceptionStackContext(handle_exception):
+        get_version(name, nvchecker_config(nvconfig), cb)
+    return loop.run_until_complete(future)
+
+
+# fields that tell whether a notification about a Pac was already sent
+DIGEST_FIELDS = ("name", "raw_local_version", "raw_remote_version")
+
+
+def info_digest(info):
+    """stable digest of the version relevant fields of an info dict"""
+    data = json.dumps([info.get(f) for f in DIGEST_FIELDS])
+    return hashlib.sha1(data.encode("utf8")).hexdigest()
+
+
 class Pac(metaclass=ABCMeta):
-    VersionFactory = parse_version
+    VersionFactory = staticmethod(parse_version)
+
+    # variables that are safe to be serialized, subclasses extend this
+    FIELDS = ("name", "raw_local_version", "raw_remote_version",
+              "local_timestamp", "remote_timestamp", "remote_checked")
+
+    __slots__ = FIELDS + (
+        "_on_local_update", "_on_remote_update", "_nvconfig",
+        "lvpatch", "rvpatch", "check_od", "check_interval",
+        "_info_serial", "_version_cache")
 
     @abstractmethod
     def __init__(self, name, **kwargs):
-        # variables that are safe to be serialized
-        self.raw_local_version = kwargs.pop("raw_local_version", None)
-        self.raw_remote_version = kwargs.pop("raw_remote_version", None)
+        for field in self.FIELDS:
+            setattr(self, field, kwargs.get(field))
 
-        self._info = kwargs
-        self._info.update({
-            "name": name,
-            "local_timestamp": TIMESTAMP,
-            "remote_timestamp": TIMESTAMP,
-        })
+        self.name = name
+        self.local_timestamp = TIMESTAMP
+        self.remote_timestamp = TIMESTAMP
 
         # don't serialize these (though nvconfig should be safe)
         self._on_local_update = []
@@ -49,12 +194,12 @@ class Pac(metaclass=ABCMeta):
         self._nvconfig = None
         self.lvpatch = self.rvpatch = lambda p, s: s
         self.check_od = operator.lt
+        self.check_interval = 0
 
-    def __getattr__(self, attr):
-        if attr in self._info:
-            return self._info[attr]
-        else:
-            raise AttributeError(attr)
+        # parsed versions, valid while (raw version, patch, info serial)
+        # stays the same
+        self._info_serial = 0
+        self._version_cache = {}
 
     def __str__(self):
         return "%s <L: %s> <R: %s>" % \
@@ -68,6 +213,22 @@ class Pac(metaclass=ABCMeta):
 
     @asyncio.coroutine
     def async_update_remote(self):
+        nvconfig = self.nvconfig
+
+        # vcs handler works on the current directory, run it elsewhere
+        if self.workdir and any(k in nvconfig for k in CWD_SOURCES):
+            loop = asyncio.get_event_loop()
+            METRICS.count_subprocess("vcs")
+            try:
+                newver = yield from loop.run_in_executor(
+                    remote_executor(), get_version_in,
+                    self.workdir, self.name, nvconfig)
+            except Exception as exp:
+                logger.error("Failed to run nvchecker for %s (%s)", self, exp)
+                newver = None
+            return self.set_remote_version(newver)
+
+        get_version, ExceptionStackContext = load_nvchecker()
         future = asyncio.Future()
 
         def handle_exception(type, value, traceback):
@@ -76,66 +237,85 @@ class Pac(metaclass=ABCMeta):
             raise value.with_traceback(traceback)
 
         def cb(name, newver):
-            future.set_result(newver is not None)
+            future.set_result(self.set_remote_version(newver))
 
-            if newver is None:
-                logger.error("nvchecker failed to get version of %s", self)
-            elif newver != self.raw_remote_version:
-                self.raw_remote_version = newver
-                self.on_remote_update()
+        with ExceptionStackContext(handle_exception):
+            get_version(self.name, nvchecker_config(nvconfig), cb)
 
-        # ugly work-around to deal with nvchecker vcs handler
-        old_cwd = os.getcwd()
-        if "path" in self._info:
-            os.chdir(os.path.join(os.path.dirname(self.path), ".."))
+        return (yield from future)
 
-        dmparser = configparser.RawConfigParser()
-        dmparser.read_dict({"_": self.nvconfig})
+    def set_remote_version(self, newver):
+        if newver is None:
+            logger.error("nvchecker failed to get version of %s", self)
+            return False
 
-        try:
-            with ExceptionStackContext(handle_exception):
-                get_version(self.name, dmparser["_"], cb)
-        finally:
-            os.chdir(old_cwd)
+        self.update_info(remote_checked=TIMESTAMP)
+        if newver != self.raw_remote_version:
+            self.raw_remote_version = newver
+            self.on_remote_update()
+        return True
+
+    @property
+    def remote_fresh(self):
+        """last successful remote check is newer than check_interval"""
+        if not self.check_interval or self.remote_checked is None:
+            return False
+        age = TIMESTAMP - self.remote_checked
+        return age.total_seconds() < self.check_interval
+
+    def update_info(self, **kwargs):
+        for field, value in kwargs.items():
+            setattr(self, field, value)
+        self._info_serial += 1
+
+    def _parse_version(self, which, raw, patch):
+        if raw is None:
+            return None
+
+        key = (raw, patch, self._info_serial)
+        cached = self._version_cache.get(which)
+        if cached is not None and cached[0] == key:
+            return cached[1]
 
-        return future
+        patched = patch(self.info, raw) if patch else raw
+        version = self.VersionFactory(patched) \
+            if patched is not None else None
+        self._version_cache[which] = (key, version)
+        return version
 
     @property
     def local_version(self):
-        if self.raw_local_version is None:
-            return None
-        else:
-            if not self.lvpatch:
-                self.lvpatch = lambda p, s: s
-            patched = self.lvpatch(self._info, self.raw_local_version)
-        return self.VersionFactory(patched) if patched is not None else None
+        return self._parse_version(
+            "local", self.raw_local_version, self.lvpatch)
 
     @property
     def remote_version(self):
-        if self.raw_remote_version is None:
-            return None
-        else:
-            if not self.rvpatch:
-                self.rvpatch = lambda p, s: s
-            patched = self.rvpatch(self._info, self.raw_remote_version)
-        return self.VersionFactory(patched) if patched is not None else None
+        return self._parse_version(
+            "remote", self.raw_remote_version, self.rvpatch)
 
     @property
     def info(self):
-        ret = self._info.copy()
-        ret.update({
-            "name": self.name,
-            "raw_local_version": self.raw_local_version,
-            "raw_remote_version": self.raw_remote_version,
-        })
-        return ret
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+    @property
+    def digest(self):
+        return info_digest(self.info)
+
+    @property
+    def workdir(self):
+        """directory where nvchecker's vcs and cmd sources run"""
+        path = getattr(self, "path", None)
+        if path is not None:
+            return os.path.join(os.path.dirname(path), "..")
+        return None
 
     @property
     def nvconfig(self):
         if self._nvconfig:
+            info = self.info
             nvconfig = {"oldver": None}
             for k, v in self._nvconfig.items():
-                nvconfig[k] = v.format(**self._info) if v is not None else None
+                nvconfig[k] = v.format(**info) if v is not None else None
             return nvconfig
         else:
             raise AttributeError("Please set nvconfig first!")
@@ -158,7 +338,7 @@ class Pac(metaclass=ABCMeta):
             self._on_local_update.append(func)
         else:
             logger.info("%s triggers on_local_update", self)
-            self._info["local_timestamp"] = TIMESTAMP
+            self.update_info(local_timestamp=TIMESTAMP)
             for f in self._on_local_update:
                 f(self)
 
@@ -166,7 +346,7 @@ class Pac(metaclass=ABCMeta):
         if func:
             self._on_remote_update.append(func)
         else:
-            self._info["remote_timestamp"] = TIMESTAMP
+            self.update_info(remote_timestamp=TIMESTAMP)
             logger.info("%s triggers on_remote_update", self)
             for f in self._on_remote_update:
                 f(self)
@@ -174,73 +354,107 @@ class Pac(metaclass=ABCMeta):
 
 @total_ordering
 class PacmanVersion:
-    regex = re.compile(r"^(?:(\d+):)?([^:-]*)(?:-([^-]+))?$")
+    """epoch:version-release, missing epoch or release is not compared"""
 
     def __init__(self, s):
-        m = self.regex.match(s)
-        if not m:
-            raise ValueError("Version string cannot be parsed")
-
-        epoch, ver, rel = m.groups()
+        epoch, ver, rel = parse_evr(s)
         self.epoch = int(epoch) if epoch is not None else None
-        self.ver = parse_version(ver)
-        self.rel = parse_version(rel) if rel else None
+        self.ver = ver
+        self.rel = rel or None
+
+        # precomputed keys of vercmp
+        self.keys = (self.epoch, vercmp_key(self.ver),
+                     vercmp_key(self.rel) if self.rel else None)
 
     def __str__(self):
         return "{}:{}-{}".format(self.epoch or '*', self.ver, self.rel or '*')
 
-    def __eq__(self, o):
+    def _cmp(self, o):
         if o is None:
             raise TypeError("")
 
-        v1 = [self.epoch, self.ver, self.rel]
-        v2 = [o.epoch, o.ver, o.rel]
-        for i in range(3):
-            if v1[i] is None or v2[i] is None or v1[i] == v2[i]:
-                continue
-            else:
-                return False
-        return True
+        k1, k2 = self.keys, o.keys
+        if k1[0] is not None and k2[0] is not None and k1[0] != k2[0]:
+            return -1 if k1[0] < k2[0] else 1
+        for i in (1, 2):
+            if k1[i] is not None and k2[i] is not None:
+                ret = vercmp_keys(k1[i], k2[i])
+                if ret:
+                    return ret
+        return 0
 
-    def __lt__(self, o):
-        if o is None:
-            raise TypeError("")
+    def __eq__(self, o):
+        return self._cmp(o) == 0
 
-        v1 = [self.epoch, self.ver, self.rel]
-        v2 = [o.epoch, o.ver, o.rel]
-        for i in range(3):
-            if v1[i] is None or v2[i] is None:
-                continue
-            elif v1[i] < v2[i]:
-                return True
-        return False
+    def __lt__(self, o):
+        return self._cmp(o) < 0
 
 
 class PKGBUILDPac(Pac):
     VersionFactory = PacmanVersion
+    FIELDS = Pac.FIELDS + ("path", "mtime", "packages", "sources")
+    __slots__ = ("path", "mtime", "packages", "sources")
 
     def __init__(self, path, **kwargs):
         kwargs["path"] = os.path.abspath(path)
         kwargs["name"] = os.path.basename(os.path.dirname(path))
         super().__init__(**kwargs)
 
-    def update_local(self):
+    def local_change(self):
+        """mtime of the PKGBUILD if it changed since last parse, else None"""
         mtime = git_last_change(self.path)
         if mtime is None:
             stat = os.stat(self.path)
             mtime = datetime.datetime.fromtimestamp(stat.st_mtime)
+        return mtime if mtime != self.mtime else None
+
+    def merge_local(self, mtime, d):
+        """apply d, as returned by pkgbuild_parser, parsed at mtime"""
+        if not d:
+            # mtime is kept, so it's parsed again next time
+            logger.error("Failed to parse %s", self.path)
+            return
+
+        old_info = self.info
+        self.update_info(mtime=mtime,
+                         packages=tuple(d["pkgname"]),
+                         sources=tuple(d.get('source', [])))
 
-        if mtime != self._info.get("mtime"):
-            old_info = self.info
-            d = pkgbuild_parser(self.path)
+        epoch = d.get("epoch", 0)
+        pkgver = d["pkgver"].split("-")[0]
+        pkgrel = d.get("pkgrel", "0")
+        self.raw_local_version = "%s:%s-%s" % (epoch, pkgver, pkgrel)
 
-            self._info["mtime"] = mtime
-            self._info["packages"] = tuple(d["pkgname"])
-            self._info["sources"] = tuple(d.get('source', []))
+        self.info != old_info and self.on_local_update()
 
-            epoch = d.get("epoch", 0)
-            pkgver = d["pkgver"].split("-")[0]
-            pkgrel = d.get("pkgrel", "0")
-            self.raw_local_version = "%s:%s-%s" % (epoch, pkgver, pkgrel)
+    def update_local(self):
+        mtime = self.local_change()
+        if mtime is not None:
+            self.merge_local(mtime, pkgbuild_parser(self.path))
+
+
+class SyncDBPac(Pac):
+    """package whose local version is read from a pacman sync db"""
+    VersionFactory = PacmanVersion
+    FIELDS = Pac.FIELDS + ("filename",)
+    __slots__ = ("filename", "syncdb")
 
-            self.info != old_info and self.on_local_update()
+    def __init__(self, name, syncdb, **kwargs):
+        super().__init__(name, **kwargs)
+        self.syncdb = syncdb
+
+    def update_local(self):
+        record = self.syncdb.get(self.name)
+        if record is None:
+            logger.error("%s is not in sync db", self.name)
+            return
+
+        # same form as PKGBUILDPac, epoch is always there
+        epoch, ver, rel = parse_evr(record.version)
+        version = "%s:%s-%s" % (epoch or 0, ver, rel or "0")
+
+        if version != self.raw_local_version or \
+           record.filename != self.filename:
+            self.update_info(filename=record.filename)
+            self.raw_local_version = version
+            self.on_local_update()
@@ -0,0 +1,218 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+from .metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# the order nvchecker uses to pick the source of a config section
+SOURCES = ("github", "aur", "pypi", "archpkg", "gems", "pacman", "cmd",
+           "bitbucket", "gcode_hg", "gcode_svn", "regex", "manual", "vcs",
+           "cratesio", "npm", "hackage", "cpan", "gitlab", "packagist",
+           "anitya", "android_sdk")
+
+
+def nvchecker_source(nvconfig):
+    for source in SOURCES:
+        if source in nvconfig:
+            return source
+    return None
+
+
+def remote_key(pac):
+    """checks with equal keys give the same result"""
+    try:
+        nvconfig = pac.nvconfig
+    except AttributeError:
+        return None
+
+    items = tuple(sorted((k, v) for k, v in nvconfig.items() if k != "oldver"))
+    return (pac.name, items, pac.workdir)
+
+
+def parse_limit(s):
+    """'<max-in-flight> [<requests per second>]' -> (int, float)"""
+    fields = s.split()
+    if not 1 <= len(fields) <= 2:
+        raise ValueError("Cannot understand limit: %s" % s)
+
+    concurrency = int(fields[0])
+    rate = float(fields[1]) if len(fields) == 2 else 0.0
+    return concurrency, rate
+
+
+class TokenBucket:
+    def __init__(self, rate, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.rate = rate
+        self.capacity = max(rate, 1.0)
+        self.tokens = self.capacity
+        self.stamp = self.loop.time()
+
+    @asyncio.coroutine
+    def take(self):
+        if self.rate <= 0:
+            return
+
+        while True:
+            now = self.loop.time()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            yield from asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SourceLimit:
+    def __init__(self, concurrency, rate, loop=None):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate, loop=loop)
+        self.waiting = 0
+        self.running = 0
+        self.done = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.running -= 1
+        self.done += 1
+        self.semaphore.release()
+
+
+class RemoteScheduler:
+    """
+    Throttle remote checks per nvchecker source: at most `concurrency`
+    requests in flight and `rate` requests per second (0 for no limit)
+    """
+
+    def __init__(self, limits={}, default=(8, 0.0), report_interval=10,
+                 loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.config = dict(limits)
+        self.default = default
+        self.report_interval = report_interval
+        self.limits = OrderedDict()
+        self.batchers = {}
+        self.checks = {}
+
+    @classmethod
+    def from_meta(cls, meta, **kwargs):
+        limits = {}
+        for key, value in meta.items():
+            if key.startswith("remote_limit_"):
+                limits[key[len("remote_limit_"):]] = parse_limit(value)
+
+        default = parse_limit(meta.get("remote_limit", "8"))
+        return cls(limits, default, **kwargs)
+
+    def add_batcher(self, source, batcher):
+        """checks of `source` accepted by batcher.update go through it"""
+        self.batchers[source] = batcher
+
+    def limit(self, source):
+        source = source or "unknown"
+        if source not in self.limits:
+            concurrency, rate = self.config.get(source, self.default)
+            self.limits[source] = SourceLimit(concurrency, rate, self.loop)
+        return self.limits[source]
+
+    @asyncio.coroutine
+    def slot(self, source):
+        """usage: with (yield from scheduler.slot(source)): ..."""
+        limit = self.limit(source)
+        limit.waiting += 1
+        try:
+            yield from limit.semaphore.acquire()
+            try:
+                yield from limit.bucket.take()
+            except:
+                limit.semaphore.release()
+                raise
+        finally:
+            limit.waiting -= 1
+
+        limit.running += 1
+        return limit
+
+    def forget(self):
+        """drop results of finished checks, they won't be shared anymore"""
+        self.checks = dict((k, v) for k, v in self.checks.items()
+                           if not v[1].done())
+
+    @asyncio.coroutine
+    def run(self, pac):
+        # the same check wanted by several repositories is done once
+        key = remote_key(pac)
+        if key is not None and key in self.checks:
+            leader, future = self.checks[key]
+            ok = yield from asyncio.shield(future)
+            newver = leader.raw_remote_version if ok else None
+            return pac.set_remote_version(newver)
+
+        future = asyncio.ensure_future(self._run(pac))
+        if key is not None:
+            self.checks[key] = (pac, future)
+        return (yield from future)
+
+    @asyncio.coroutine
+    def _run(self, pac):
+        try:
+            source = nvchecker_source(pac.nvconfig)
+        except AttributeError:
+            source = None
+
+        # a batcher takes the slot itself, once per batch
+        batcher = self.batchers.get(source)
+        if batcher and batcher.accepts(pac.nvconfig):
+            return (yield from self.timed(source, batcher.update(pac)))
+
+        with (yield from self.slot(source)):
+            return (yield from self.timed(source, pac.async_update_remote()))
+
+    @asyncio.coroutine
+    def timed(self, source, check):
+        # latency of a check once it's out of the queue
+        start = time.monotonic()
+        ok = False
+        try:
+            ok = yield from check
+            return ok
+        finally:
+            METRICS.observe_remote(source, time.monotonic() - start, ok)
+
+    def report(self):
+        for source, limit in self.limits.items():
+            if limit.waiting or limit.running:
+                logger.info("%s: %d queued, %d running, %d done", source,
+                            limit.waiting, limit.running, limit.done)
+
+    @asyncio.coroutine
+    def run_all(self, paclist):
+        paclist = list(paclist)
+        tasks = [asyncio.ensure_future(self.run(pac)) for pac in paclist]
+        if not tasks:
+            return []
+
+        while True:
+            done, pending = yield from asyncio.wait(
+                tasks, timeout=self.report_interval)
+            if not pending:
+                break
+            self.report()
+
+        results = []
+        for pac, task in zip(paclist, tasks):
+            exp = task.exception()
+            if exp is not None:
+                logger.error("Remote check of %s failed (%r)",
+                             getattr(pac, "name", pac), exp,
+                             exc_info=(type(exp), exp, exp.__traceback__))
+            results.append(task.result() if exp is None else False)
+        return results
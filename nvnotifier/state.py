@@ -0,0 +1,169 @@
+import os
+import pickle
+import sqlite3
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pac (
+    name TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS status (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    since BLOB NOT NULL,
+    PRIMARY KEY (kind, name)
+);
+CREATE TABLE IF NOT EXISTS notifier (
+    notifier TEXT NOT NULL,
+    key TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (notifier, key)
+);
+"""
+
+
+def _dump(obj):
+    data = pickle.dumps(obj)
+    return hashlib.sha1(data).hexdigest(), data
+
+
+class StateStore:
+    """
+    Session data of one repository in a SQLite database, one row per
+    package / notifier record. Saving only writes rows that changed.
+    """
+
+    def __init__(self, fname, legacy=None):
+        new = not os.path.exists(fname)
+        self.fname = fname
+        self.db = sqlite3.connect(fname, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+        if new and legacy and os.path.exists(legacy):
+            self.migrate(legacy)
+
+    def close(self):
+        self.db.close()
+
+    def migrate(self, fname):
+        """
+        import the session pickle of older versions (written by
+        serializer.PickledData, a plain pickled dict)
+        """
+        with open(fname, "rb") as fin:
+            try:
+                pickled = pickle.load(fin)
+            except EOFError:
+                return
+
+        logger.info("Import session data from %r", fname)
+        self.save_pacs(pickled.get("paclist", []))
+        for kind in ("out_of_date", "not_ready"):
+            self.save_status(kind, pickled.get(kind, {}))
+        for name, data in pickled.get("notifier_data", {}).items():
+            self.save_notifier_data(name, data)
+        for key in ("git_index", "head", "blacklist"):
+            if key in pickled:
+                self.set(key, pickled[key])
+
+    def get(self, key, default=None):
+        row = self.db.execute("SELECT data FROM meta WHERE key = ?",
+                              (key,)).fetchone()
+        return pickle.loads(row[0]) if row else default
+
+    def set(self, key, value):
+        digest, data = _dump(value)
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta (key, digest, data) "
+                "SELECT ?, ?, ? WHERE NOT EXISTS "
+                "(SELECT 1 FROM meta WHERE key = ? AND digest = ?)",
+                (key, digest, data, key, digest))
+
+    def paclist(self):
+        cursor = self.db.execute("SELECT data FROM pac")
+        return (pickle.loads(row[0]) for row in cursor)
+
+    def save_pacs(self, infos, complete=True):
+        """
+        save info dicts of Pacs, if complete is True, Pacs not in infos
+        are removed
+        """
+        saved = dict(self.db.execute("SELECT name, digest FROM pac"))
+        names = set()
+        changed = []
+        for info in infos:
+            names.add(info["name"])
+            digest, data = _dump(info)
+            if saved.get(info["name"]) != digest:
+                changed.append((info["name"], digest, data))
+
+        removed = [(name,) for name in saved if name not in names]
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO pac (name, digest, data) "
+                "VALUES (?, ?, ?)", changed)
+            if complete:
+                self.db.executemany("DELETE FROM pac WHERE name = ?", removed)
+
+        logger.debug("Saved %d changed Pacs", len(changed))
+
+    def get_status(self, kind):
+        cursor = self.db.execute(
+            "SELECT name, since FROM status WHERE kind = ?", (kind,))
+        return dict((name, pickle.loads(since)) for name, since in cursor)
+
+    def save_status(self, kind, status):
+        saved = self.get_status(kind)
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO status (kind, name, since) "
+                "VALUES (?, ?, ?)",
+                [(kind, name, pickle.dumps(since))
+                 for name, since in status.items()
+                 if saved.get(name) != since])
+            self.db.executemany(
+                "DELETE FROM status WHERE kind = ? AND name = ?",
+                [(kind, name) for name in saved if name not in status])
+
+    def notifiers(self):
+        cursor = self.db.execute("SELECT DISTINCT notifier FROM notifier")
+        return [row[0] for row in cursor]
+
+    def get_notifier_data(self, notifier):
+        cursor = self.db.execute(
+            "SELECT key, data FROM notifier WHERE notifier = ?", (notifier,))
+        return dict((key, pickle.loads(data)) for key, data in cursor)
+
+    def save_notifier_data(self, notifier, data):
+        data = data or {}
+        saved = dict(self.db.execute(
+            "SELECT key, digest FROM notifier WHERE notifier = ?",
+            (notifier,)))
+
+        changed = []
+        for key, value in data.items():
+            digest, blob = _dump(value)
+            if saved.get(key) != digest:
+                changed.append((notifier, key, digest, blob))
+
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO notifier (notifier, key, digest, data)"
+                " VALUES (?, ?, ?, ?)", changed)
+            self.db.executemany(
+                "DELETE FROM notifier WHERE notifier = ? AND key = ?",
+                [(notifier, key) for key in saved if key not in data])
@@ -0,0 +1,206 @@
+"""
+Version comparison of pacman (rpmvercmp in libalpm/version.c)
+
+A version string is split into its alphanumeric segments once, comparing
+two keys is then a loop over tuples instead of walking both strings.
+"""
+
+import re
+
+_SEGMENT = re.compile(r"([^0-9A-Za-z]*)(?:([0-9]+)|([A-Za-z]+))")
+
+
+def vercmp_key(s):
+    """
+    (segments, trailing): a segment is (length of separators before it,
+    1 for numeric and 0 for alphabetic, value), trailing tells whether
+    the string ends with separators
+    """
+    segments = []
+    end = 0
+    for m in _SEGMENT.finditer(s):
+        sep, num, alpha = m.groups()
+        if num is not None:
+            segments.append((len(sep), 1, int(num)))
+        else:
+            segments.append((len(sep), 0, alpha))
+        end = m.end()
+    return tuple(segments), end < len(s)
+
+
+def _cmp_rest(segment, trailing):
+    """segment of one version against the end of the other one"""
+    sep, isnum, _ = segment
+    # an alphabetic suffix like 1.0a or 1.0.a after 1.0. never wins
+    if trailing or sep == 0:
+        return 1 if isnum else -1
+    return 1
+
+
+def vercmp_keys(k1, k2):
+    seg1, trailing1 = k1
+    seg2, trailing2 = k2
+
+    for a, b in zip(seg1, seg2):
+        if a != b:
+            return -1 if a < b else 1
+
+    if len(seg1) > len(seg2):
+        return _cmp_rest(seg1[len(seg2)], trailing2)
+    elif len(seg1) < len(seg2):
+        return -_cmp_rest(seg2[len(seg1)], trailing1)
+    else:
+        return trailing1 - trailing2
+
+
+def rpmvercmp(a, b):
+    """-1, 0 or 1 like rpmvercmp() of pacman"""
+    if a == b:
+        return 0
+    return vercmp_keys(vercmp_key(a), vercmp_key(b))
+
+
+def parse_evr(s):
+    """
+    (epoch, version, release) like parseEVR() of pacman, but missing
+    epoch and release are None
+    """
+    version = s.lstrip("0123456789")
+    epoch = s[:len(s)-len(version)]
+    if version.startswith(":"):
+        version = version[1:]
+        epoch = epoch or "0"
+    else:
+        version = s
+        epoch = None
+
+    version, dash, release = version.rpartition("-")
+    if not dash:
+        version, release = release, None
+    return epoch, version, release
+
+
+def vercmp(a, b):
+    """-1, 0 or 1 like vercmp(8) of pacman, release compared if both have it"""
+    if a == b:
+        return 0
+
+    epoch1, ver1, rel1 = parse_evr(a)
+    epoch2, ver2, rel2 = parse_evr(b)
+    ret = rpmvercmp(epoch1 or "0", epoch2 or "0")
+    if ret == 0:
+        ret = rpmvercmp(ver1, ver2)
+    if ret == 0 and rel1 is not None and rel2 is not None:
+        ret = rpmvercmp(rel1, rel2)
+    return ret
+
+
+# cases of test/util/vercmptest.sh in pacman, each one is also checked
+# the other way around
+VERCMP_TESTS = (
+    # all similar length, no pkgrel
+    ("1.5.0", "1.5.0", 0),
+    ("1.5.1", "1.5.0", 1),
+    # mixed length
+    ("1.5.1", "1.5", 1),
+    # with pkgrel, simple
+    ("1.5.0-1", "1.5.0-1", 0),
+    ("1.5.0-1", "1.5.0-2", -1),
+    ("1.5.0-1", "1.5.1-1", -1),
+    ("1.5.0-2", "1.5.1-1", -1),
+    # with pkgrel, mixed lengths
+    ("1.5-1", "1.5.1-1", -1),
+    ("1.5-2", "1.5.1-1", -1),
+    ("1.5-2", "1.5.1-2", -1),
+    # mixed pkgrel inclusion
+    ("1.5", "1.5-1", 0),
+    ("1.5-1", "1.5", 0),
+    ("1.1-1", "1.1", 0),
+    ("1.0-1", "1.1", -1),
+    ("1.1-1", "1.0", 1),
+    # alphanumeric versions
+    ("1.5b-1", "1.5-1", -1),
+    ("1.5b", "1.5", -1),
+    ("1.5b-1", "1.5", -1),
+    ("1.5b", "1.5.1", -1),
+    # from the manpage
+    ("1.0a", "1.0alpha", -1),
+    ("1.0alpha", "1.0b", -1),
+    ("1.0b", "1.0beta", -1),
+    ("1.0beta", "1.0rc", -1),
+    ("1.0rc", "1.0", -1),
+    # going crazy? alpha-dotted versions
+    ("1.5.a", "1.5", 1),
+    ("1.5.b", "1.5.a", 1),
+    ("1.5.1", "1.5.b", 1),
+    # alpha dots and dashes
+    ("1.5.b-1", "1.5.b", 0),
+    ("1.5-1", "1.5.b", -1),
+    # same/similar content, differing separators
+    ("2.0", "2_0", 0),
+    ("2.0_a", "2_0.a", 0),
+    ("2.0a", "2.0.a", -1),
+    ("2___a", "2_a", 1),
+    # epoch included version comparisons
+    ("0:1.0", "0:1.0", 0),
+    ("0:1.0", "0:1.1", -1),
+    ("1:1.0", "0:1.0", 1),
+    ("1:1.0", "0:1.1", 1),
+    ("1:1.0", "2:1.1", -1),
+    # epoch + sometimes present pkgrel
+    ("1:1.0", "0:1.0-1", 1),
+    ("1:1.0-1", "0:1.1-1", 1),
+    # epoch included on one version
+    ("0:1.0", "1.0", 0),
+    ("0:1.0", "1.1", -1),
+    ("0:1.1", "1.0", 1),
+    ("1:1.0", "1.0", 1),
+    ("1:1.0", "1.1", 1),
+    ("1:1.1", "1.1", 1),
+)
+
+
+if __name__ == "__main__":
+    # python -m nvnotifier.vercmp: conformance with pacman, then timing
+    import timeit
+
+    failed = 0
+    for a, b, expected in VERCMP_TESTS:
+        for x, y, want in ((a, b, expected), (b, a, -expected)):
+            got = vercmp(x, y)
+            if got != want:
+                failed += 1
+                print("FAIL: vercmp %s %s = %d, expected %d" %
+                      (x, y, got, want))
+    print("%d/%d vercmp tests passed" %
+          (2 * len(VERCMP_TESTS) - failed, 2 * len(VERCMP_TESTS)))
+
+    versions = [v for a, b, _ in VERCMP_TESTS for v in (a, b)
+                if ":" not in v and "-" not in v]
+    pairs = list(zip(versions, versions[1:]))
+    number = 200
+
+    def bench(name, parse, compare):
+        parsed = [parse(v) for v in versions]
+        keyed = [(parse(a), parse(b)) for a, b in pairs]
+        t1 = timeit.timeit(lambda: [parse(v) for v in versions],
+                           number=number)
+        t2 = timeit.timeit(lambda: [compare(a, b) for a, b in keyed],
+                           number=number)
+        print("%s: %.2f us/parse, %.2f us/compare" %
+              (name, t1 / number / len(parsed) * 1e6,
+               t2 / number / len(keyed) * 1e6))
+
+    bench("vercmp_key", vercmp_key, vercmp_keys)
+    try:
+        import warnings
+        from pkg_resources import parse_version
+    except ImportError:
+        print("setuptools is not installed, parse_version is not timed")
+    else:
+        # most of the versions aren't PEP 440 ones
+        warnings.simplefilter("ignore")
+        bench("parse_version", parse_version,
+              lambda a, b: (a > b) - (a < b))
+
+    raise SystemExit(1 if failed else 0)